@@ -1,17 +1,15 @@
 import os
 import time
 import threading
-from langchain_ollama import OllamaLLM
+from llm_clients import LLM_MODEL_NAME, get_llm as get_llm_por_papel
 
 # --- CONFIGURAÇÕES ---
-# Certifique-se de que este é o mesmo modelo que você está servindo com o Ollama
-# Usei o nome completo que você forneceu para garantir a compatibilidade.
-LLM_MODEL_NAME = "phi3:3.8b-mini-4k-instruct-q4_0"
+# O modelo servido pelo Ollama é definido em llm_clients.py
 PROMPT_FILE_PATH = "prompt_para_llm.txt"
 
 def get_llm():
     """Inicializa e retorna a instância do LLM do Ollama."""
-    return OllamaLLM(model=LLM_MODEL_NAME)
+    return get_llm_por_papel("analyzer")
 
 def ler_prompt_do_arquivo(caminho_arquivo):
     """Lê o conteúdo completo de um arquivo de texto."""
@@ -1,46 +1,67 @@
-from flask import Flask, jsonify, request
+from flask import Flask, jsonify, request, Response, stream_with_context
 from flask_cors import CORS
 import yaml
 import os
 import json
 from datetime import datetime, date, timedelta
-from langchain_ollama import OllamaLLM
 import threading
-import sqlite3
-import ollama
-from database import DATABASE_NAME, init_db
-from llm_classifier import analyze_and_store_exam, CLASSIFICATION_PROMPT_TEMPLATE
+from contextlib import contextmanager
+from llm_clients import LLM_MODEL_NAME, OLLAMA_KEEP_ALIVE, OLLAMA_NUM_CTX, get_llm, get_ollama_client
+from database import ROLLUP_GRANULARIDADES, conexao, fechar_conexoes, init_db, inicio_do_periodo, preencher_rollups_categoria
+from classification_cache import hash_texto
+from llm_classifier import analyze_and_store_exam, classify_exam
+from job_manager import iniciar_job, aguardar_job, job_ativo, aguardar_jobs_ativos, recuperar_jobs_interrompidos, JOB_MAX_WAIT
+from classification_worker import enqueue_answer, wait_for_pending, encerrar as encerrar_classificacoes
+from session_store import carregar_respostas, carregar_historico, ids_respondidos, registrar_resposta, encerrar_sessoes_abertas, encerrar_se_de_outro_dia, migrar_respostas_yaml
+from rag_answer_cache import buscar_resposta_exata, buscar_resposta_semelhante, salvar_resposta, coalesce, iniciar_geracao, concluir_geracao
 from langchain.prompts import PromptTemplate
 from langchain_huggingface import HuggingFaceEmbeddings
-from langchain_community.vectorstores import FAISS
-from langchain.chains import RetrievalQA
+from rag_engineering import CONFIGURED_INDEX_TYPE, carregar_vectorstore, caminho_indice
+from health import verificar_sistema
+from metrics import cronometrar, incrementar, exportar as exportar_metricas
+from rag_context import montar_contexto
+from lexical_index import LEXICAL_INDEX_FILE, abrir_indice_lexical_leitura, fundir_por_rrf, buscar as buscar_bm25
 
 # --- CONFIGURAÇÕES ---
 ARQUIVO_PERGUNTAS = 'perguntas.yaml'
-ARQUIVO_RESPOSTAS = 'respostas.yaml'
-LLM_MODEL_NAME = "phi3:3.8b-mini-4k-instruct-q4_0"
-LOCK_FILE_PATH = 'analysis.lock'
+ARQUIVO_RESPOSTAS = 'respostas.yaml'  # formato antigo, migrado para o banco na inicialização
+LOCK_FILE_PATH = 'analysis.lock'  # usado por versões anteriores; removido na inicialização se tiver sobrado
 RAG_INDEX_PATH = "faiss_index_mistral"
 EMBEDDING_MODEL_NAME = "sentence-transformers/paraphrase-multilingual-mpnet-base-v2"
+TRENDS_PAGE_SIZE = 12  # períodos por página em /api/dashboard/categories
+TRENDS_MAX_PAGE_SIZE = 100
+CLASSIFICATION_WAIT_TIMEOUT = 120  # segundos aguardando as classificações em segundo plano
+RAG_TOP_K = 8  # trechos candidatos para cada pergunta (o orçamento de tokens decide quantos vão ao prompt)
+RAG_FETCH_K = 20  # trechos buscados no índice antes da diversificação por MMR
+RAG_MMR_LAMBDA = 0.7  # 1.0 = só relevância, 0.0 = só diversidade
+# Tipo de índice usado nas consultas (flat, hnsw, ivfpq, sq8 ou fp16) e se o arquivo é mapeado em memória.
+# Os tipos diferentes de "flat" precisam ter sido gerados por build_index (ver benchmark_indices.py).
+RAG_INDEX_TYPE = CONFIGURED_INDEX_TYPE  # INSPECTORUM_INDEX_TYPE
+RAG_INDEX_MMAP = os.environ.get("INSPECTORUM_INDEX_MMAP", "1") == "1"
+# Aquecimento opcional: com INSPECTORUM_WARMUP=1, o RAG e o modelo são carregados
+# em segundo plano assim que o servidor sobe, em vez de na primeira pergunta.
+WARMUP_ON_START = os.environ.get("INSPECTORUM_WARMUP", "0") == "1"
+
+# Quantas gerações longas (análise e RAG) podem rodar ao mesmo tempo. As demais recebem 503 com
+# Retry-After (ou um evento 'error' no streaming) em vez de ocupar as threads do servidor que
+# atendem as rotas rápidas (exame, dashboard). Respostas vindas do cache não disputam vaga.
+LLM_MAX_CONCURRENT = int(os.environ.get("INSPECTORUM_LLM_CONCURRENCY", "2"))
+LLM_QUEUE_TIMEOUT = 5  # segundos aguardando uma vaga antes de responder 503
 
 # --- INICIALIZAÇÃO DO FLASK ---
 app = Flask(__name__)
 CORS(app, resources={r"/api/*": {"origins": "http://localhost:3000"}})
 
+# Esquema criado uma única vez por processo; as rotas apenas emprestam conexões do pool
+init_db()
+migrar_respostas_yaml(ARQUIVO_RESPOSTAS)
+recuperar_jobs_interrompidos()
+if os.path.exists(LOCK_FILE_PATH): os.remove(LOCK_FILE_PATH)
+
 # --- LÓGICA DE CARREGAMENTO DO RAG (Lazy Loading) ---
-qa_chain = None
-def get_rag_chain():
-    global qa_chain
-    if qa_chain is None:
-        print("Inicializando a cadeia de RAG pela primeira vez...")
-        if not os.path.exists(RAG_INDEX_PATH):
-            raise FileNotFoundError(f"Índice RAG não encontrado em '{RAG_INDEX_PATH}'.")
-        
-        embeddings = HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL_NAME)
-        vector_store = FAISS.load_local(RAG_INDEX_PATH, embeddings, allow_dangerous_deserialization=True)
-        llm = OllamaLLM(model=LLM_MODEL_NAME, temperature=0.1)
-        
-        simplified_rag_template = """
+# As rotas de consulta montam o prompt e chamam o LLM diretamente (ver responder_pergunta_rag);
+# aqui ficam apenas os componentes carregados uma vez por processo.
+SIMPLIFIED_RAG_TEMPLATE = """
 Use a seguinte informação de contexto para responder à pergunta no final. Responda de forma pastoral e baseie-se estritamente no texto fornecido. Se a resposta não estiver no contexto, diga de forma clara que a informação não foi encontrada nos documentos disponíveis.
 
 Contexto:
@@ -49,151 +70,237 @@ Contexto:
 Pergunta: {question}
 Resposta:
 """
-        prompt = PromptTemplate(template=simplified_rag_template, input_variables=["context", "question"])
-        
-        qa_chain = RetrievalQA.from_chain_type(
-            llm=llm,
-            chain_type="stuff",
-            retriever=vector_store.as_retriever(),
-            chain_type_kwargs={"prompt": prompt},
-            return_source_documents=True
-        )
-        print("Cadeia de RAG pronta.")
-    return qa_chain
+rag_carregado = False
+rag_llm = None
+rag_prompt = None
+rag_vector_store = None
+rag_embeddings = None
+rag_lexical = None  # conexão somente leitura com o índice BM25 (None se o índice não tiver BM25)
+rag_index_version = None  # versão do índice carregado em memória (chave das respostas em cache)
+_rag_lock = threading.Lock()
+_lexical_lock = threading.Lock()
 
-# --- ROTA DE VERIFICAÇÃO DO SISTEMA ---
-@app.route('/api/system/health', methods=['GET'])
-def system_health_check():
-    errors = []
-    required_files = ['perguntas.yaml', 'faiss_index_mistral/index.faiss']
-    for file_path in required_files:
-        if not os.path.exists(file_path):
-            if 'progress.db' in file_path:
-                print("Arquivo 'progress.db' não encontrado, será criado no primeiro exame.")
-            else:
-                errors.append(f"Arquivo essencial não encontrado: {file_path}")
+def carregar_rag():
+    """Carrega o índice, os embeddings, o LLM e o prompt do RAG na primeira chamada."""
+    global rag_carregado, rag_llm, rag_prompt, rag_vector_store, rag_embeddings, rag_lexical, rag_index_version
+    if rag_carregado:
+        return
+    # O lock garante que requisições simultâneas não carreguem tudo duas vezes
+    with _rag_lock:
+        if rag_carregado:
+            return
+        print("Inicializando o RAG pela primeira vez...")
+        if not os.path.exists(RAG_INDEX_PATH):
+            raise FileNotFoundError(f"Índice RAG não encontrado em '{RAG_INDEX_PATH}'.")
+
+        # A versão é lida antes dos arquivos: se o índice for reconstruído no meio da carga,
+        # as respostas ficam marcadas com a versão antiga e são descartadas, nunca o contrário
+        rag_index_version = versao_do_indice()
+        embeddings = HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL_NAME)
+        rag_vector_store = carregar_vectorstore(embeddings, RAG_INDEX_PATH, index_type=RAG_INDEX_TYPE, mmap=RAG_INDEX_MMAP)
+        rag_embeddings = embeddings
+        caminho_lexical = os.path.join(RAG_INDEX_PATH, LEXICAL_INDEX_FILE)
+        if os.path.exists(caminho_lexical):
+            rag_lexical = abrir_indice_lexical_leitura(caminho_lexical)
+        rag_llm = get_llm("rag")
+        rag_prompt = PromptTemplate(template=SIMPLIFIED_RAG_TEMPLATE, input_variables=["context", "question"])
+        rag_carregado = True
+        print("RAG pronto.")
+
+# --- AQUECIMENTO NA INICIALIZAÇÃO ---
+warmup_state = {"status": "ready" if not WARMUP_ON_START else "starting", "error": None}
 
+def warm_up():
+    """Carrega o RAG e pede ao Ollama para carregar e manter o modelo na memória."""
     try:
-        print("Verificando a disponibilidade do modelo LLM...")
-        llm = OllamaLLM(model=LLM_MODEL_NAME)
-        llm.invoke("teste") 
-        print("Modelo LLM carregado com sucesso.")
+        print("Aquecimento: carregando o RAG...")
+        carregar_rag()
+        print("Aquecimento: carregando o modelo no Ollama...")
+        # Um prompt vazio apenas carrega o modelo, sem gerar texto
+        get_ollama_client().generate(
+            model=LLM_MODEL_NAME, prompt="", keep_alive=OLLAMA_KEEP_ALIVE, options={"num_ctx": OLLAMA_NUM_CTX}
+        )
+        warmup_state["status"] = "ready"
+        print("Aquecimento concluído. Servidor pronto.")
     except Exception as e:
-        error_message = str(e)
-        if "404" in error_message:
-             errors.append(f"Modelo LLM '{LLM_MODEL_NAME}' não encontrado no Ollama. Execute 'ollama pull {LLM_MODEL_NAME}'.")
-        else:
-            errors.append(f"Não foi possível carregar o modelo do Ollama. O serviço está rodando? Erro: {e}")
+        warmup_state.update(status="error", error=str(e))
+        print(f"Erro no aquecimento do servidor: {e}")
+
+def iniciar_aquecimento():
+    warmup_state.update(status="starting", error=None)
+    threading.Thread(target=warm_up, daemon=True).start()
+
+@app.route('/api/system/ready', methods=['GET'])
+def system_ready():
+    """Informa se o servidor ainda está aquecendo ('starting') ou já está pronto ('ready')."""
+    return jsonify({
+        "status": warmup_state["status"],
+        "warmup": WARMUP_ON_START,
+        "rag_loaded": rag_carregado,
+        "error": warmup_state["error"]
+    })
+
+# --- LIMITE DE GERAÇÕES SIMULTÂNEAS ---
+_vagas_llm = threading.BoundedSemaphore(LLM_MAX_CONCURRENT)
+MENSAGEM_OCUPADO = "O servidor está ocupado com outras gerações. Tente novamente em instantes."
+
+class ServidorOcupado(Exception):
+    """Nenhuma vaga de geração ficou livre em LLM_QUEUE_TIMEOUT segundos."""
 
-    if not errors:
-        return jsonify({"status": "ok", "message": "Sistema pronto."})
+@contextmanager
+def vaga_llm():
+    """
+    Reserva uma vaga de geração apenas durante a chamada ao LLM (inclusive enquanto os tokens são
+    enviados em streaming). Consultas ao cache, buscas no índice e esperas não ocupam vaga.
+    """
+    if not _vagas_llm.acquire(timeout=LLM_QUEUE_TIMEOUT):
+        raise ServidorOcupado(MENSAGEM_OCUPADO)
+    try:
+        yield
+    finally:
+        _vagas_llm.release()
+
+def resposta_ocupado():
+    resposta = jsonify({"error": MENSAGEM_OCUPADO})
+    resposta.status_code = 503
+    resposta.headers["Retry-After"] = str(LLM_QUEUE_TIMEOUT)
+    return resposta
+
+# --- ROTA DE VERIFICAÇÃO DO SISTEMA ---
+@app.route('/api/system/health', methods=['GET'])
+def system_health_check():
+    """
+    Verificação rápida (lista de modelos do Ollama, arquivos e esquema do banco), em cache por alguns segundos.
+    Com '?deep=1', também faz uma geração curta e cronometrada no modelo.
+    """
+    deep = request.args.get('deep', '0') == '1'
+    arquivos = [ARQUIVO_PERGUNTAS, caminho_indice(RAG_INDEX_PATH, RAG_INDEX_TYPE)]
+    resultado = verificar_sistema(arquivos, deep=deep)
+    if resultado["status"] == "ok":
+        return jsonify(dict(resultado, message="Sistema pronto."))
     else:
-        return jsonify({"status": "error", "errors": errors}), 500
+        return jsonify(resultado), 500
 
 # --- FUNÇÕES AUXILIARES E ROTAS DO EXAME ---
 
+# Catálogo de perguntas em memória, recarregado apenas quando o perguntas.yaml muda no disco
+_catalogo = {"mtime": None, "perguntas": [], "mapa": {}}
+_catalogo_lock = threading.Lock()
+
+def carregar_catalogo():
+    """Retorna (lista de perguntas, mapa id -> pergunta), relendo o YAML só se o arquivo mudou."""
+    mtime = os.path.getmtime(ARQUIVO_PERGUNTAS)
+    with _catalogo_lock:
+        if _catalogo["mtime"] != mtime:
+            with open(ARQUIVO_PERGUNTAS, 'r', encoding='utf-8') as file:
+                perguntas = yaml.safe_load(file)['perguntas']
+            _catalogo.update(mtime=mtime, perguntas=perguntas, mapa={p['id']: p for p in perguntas})
+        return _catalogo["perguntas"], _catalogo["mapa"]
+
+preencher_rollups_categoria({p['id']: p.get('categoria', "") for p in carregar_catalogo()[0]})
+
 def carregar_perguntas():
-    with open(ARQUIVO_PERGUNTAS, 'r', encoding='utf-8') as file:
-        return yaml.safe_load(file)['perguntas']
+    return carregar_catalogo()[0]
 
-def carregar_respostas_salvas():
-    if not os.path.exists(ARQUIVO_RESPOSTAS): return []
-    try:
-        with open(ARQUIVO_RESPOSTAS, 'r', encoding='utf-8') as file:
-            dados = yaml.safe_load(file)
-            return dados.get('respostas', []) if dados else []
-    except (yaml.YAMLError, IOError):
-        return []
+def mensagem_pergunta(pergunta, timestamp):
+    return {"id": f"q-{pergunta['id']}", "type": "ai", "content": pergunta['texto'], "categoria": pergunta['categoria'], "timestamp": timestamp}
 
-def analyze_and_store_exam_with_lock():
-    try:
-        with open(LOCK_FILE_PATH, 'w') as f: f.write('processing')
-        analyze_and_store_exam()
-    finally:
-        if os.path.exists(LOCK_FILE_PATH): os.remove(LOCK_FILE_PATH)
-        print("Tarefa de análise de progresso finalizada e lock removido.")
+def proxima_pergunta(respondidas):
+    return next((p for p in carregar_perguntas() if p['id'] not in respondidas), None)
+
+def carregar_respostas_salvas():
+    return carregar_respostas()
 
 @app.route('/api/exame/start-new', methods=['POST'])
 def start_new_exam():
-    if os.path.exists(ARQUIVO_RESPOSTAS):
-        os.remove(ARQUIVO_RESPOSTAS)
+    encerrar_sessoes_abertas()
     return jsonify({"message": "Novo exame iniciado."})
 
 @app.route('/api/exame/current-state', methods=['GET'])
 def get_current_state():
-    if os.path.exists(ARQUIVO_RESPOSTAS):
-        try:
-            with open(ARQUIVO_RESPOSTAS, 'r', encoding='utf-8') as f:
-                dados_salvos = yaml.safe_load(f)
-                if dados_salvos and 'data_exame' in dados_salvos:
-                    data_salva = datetime.fromisoformat(dados_salvos['data_exame']).date()
-                    if data_salva < date.today():
-                        print(f"Exame do dia {data_salva} encontrado. Limpando para o novo dia.")
-                        os.remove(ARQUIVO_RESPOSTAS)
-        except Exception as e:
-            print(f"Erro ao verificar data do exame antigo: {e}")
+    try:
+        data_salva = encerrar_se_de_outro_dia()
+        if data_salva:
+            print(f"Exame do dia {data_salva} encontrado. Limpando para o novo dia.")
+    except Exception as e:
+        print(f"Erro ao verificar data do exame antigo: {e}")
+
+    # Com 'since' (id da última resposta que o cliente já tem), só os itens novos são enviados
+    since = request.args.get('since', default=0, type=int)
+    todas_as_perguntas, mapa_perguntas = carregar_catalogo()
+    session_id, respostas_novas = carregar_historico(since)
+    respondidas = ids_respondidos(session_id) if session_id else set()
+    cursor = respostas_novas[-1]['id'] if respostas_novas else since
 
-    todas_as_perguntas = carregar_perguntas()
-    respostas_salvas = carregar_respostas_salvas()
-    mapa_perguntas = {p['id']: p for p in todas_as_perguntas}
-    history, ids_respondidos = [], set()
-    for resposta in respostas_salvas:
+    history = []
+    for resposta in respostas_novas:
         question_id = resposta['id_pergunta']
         if question_id in mapa_perguntas:
-            pergunta_obj = mapa_perguntas[question_id]
-            history.append({"id": f"q-{question_id}", "type": "ai", "content": pergunta_obj['texto'], "categoria": pergunta_obj['categoria'], "timestamp": datetime.now().isoformat()})
-            history.append({"id": f"a-{question_id}", "type": "user", "content": resposta['resposta'], "timestamp": datetime.now().isoformat()})
-            ids_respondidos.add(question_id)
-    perguntas_a_fazer = [p for p in todas_as_perguntas if p['id'] not in ids_respondidos]
-    if not perguntas_a_fazer:
-        return jsonify({ "status": "completed", "history": history })
+            history.append(mensagem_pergunta(mapa_perguntas[question_id], resposta['answered_at']))
+            history.append({"id": f"a-{question_id}", "type": "user", "content": resposta['resposta'], "timestamp": resposta['answered_at']})
+
+    progresso = {"answered": len(respondidas & mapa_perguntas.keys()), "total": len(todas_as_perguntas)}
+    next_question = proxima_pergunta(respondidas)
+    if next_question is None:
+        return jsonify({"status": "completed", "history": history, "cursor": cursor, "session_id": session_id, "progress": progresso})
     else:
-        next_question = perguntas_a_fazer[0]
-        history.append({"id": f"q-{next_question['id']}", "type": "ai", "content": next_question['texto'], "categoria": next_question['categoria'], "timestamp": datetime.now().isoformat()})
-        return jsonify({"status": "in_progress", "history": history, "next_question": next_question})
+        history.append(mensagem_pergunta(next_question, datetime.now().isoformat()))
+        return jsonify({"status": "in_progress", "history": history, "next_question": next_question, "cursor": cursor, "session_id": session_id, "progress": progresso})
 
 @app.route('/api/exame/submit-answer', methods=['POST'])
 def submit_answer():
-    data = request.json
-    respostas_salvas = carregar_respostas_salvas()
-    respostas_salvas.append({'id_pergunta': data.get('question_id'), 'resposta': data.get('answer')})
-    # Corrigindo para usar a função salvar_progresso que já existe
-    salvar_progresso(respostas_salvas)
-    return jsonify({"message": "Resposta salva com sucesso."})
+    data = request.get_json(silent=True) or {}
+    question_id = data.get('question_id')
+    answer = data.get('answer')
+    _, mapa_perguntas = carregar_catalogo()
+    if not isinstance(question_id, str) or not question_id.strip():
+        return jsonify({"error": "O campo 'question_id' é obrigatório."}), 400
+    if question_id not in mapa_perguntas:
+        return jsonify({"error": f"Pergunta '{question_id}' não encontrada."}), 400
+    if not isinstance(answer, str) or not answer.strip():
+        return jsonify({"error": "O campo 'answer' é obrigatório e não pode estar vazio."}), 400
 
-@app.route('/api/exame/analyze', methods=['POST'])
-def analyze_exam():
-    try:
-        init_db()
-        perguntas_data = {p['id']: p for p in carregar_perguntas()}
-        respostas_data = carregar_respostas_salvas()
-        
-        llm_classifier = OllamaLLM(model=LLM_MODEL_NAME, format='json', temperature=0.1)
-        prompt_template_classifier = PromptTemplate.from_template(CLASSIFICATION_PROMPT_TEMPLATE)
-        
-        pecados_identificados = []
-        for resp in respostas_data:
-            question_id, answer_text = resp['id_pergunta'], resp['resposta']
-            question_text = perguntas_data.get(question_id, {}).get('texto', "")
-            if not question_text or not answer_text.strip(): continue
+    session_id, cursor = registrar_resposta(question_id, answer)
+    # Classifica a resposta em segundo plano para adiantar o trabalho da análise final
+    enqueue_answer(question_id, mapa_perguntas[question_id], answer)
 
-            prompt_clf = prompt_template_classifier.format(question=question_text, answer=answer_text)
-            try:
-                llm_output_str = llm_classifier.invoke(prompt_clf)
-                llm_output = json.loads(llm_output_str)
-                if llm_output.get('pecado') == 1:
-                    pecados_identificados.append({"pergunta": question_text, "resposta": answer_text})
-            except Exception as e:
-                print(f"Erro ao classificar pergunta {question_id}: {e}")
-        
-        if not pecados_identificados:
-            analise_textual = "Análise concluída. Com base em suas respostas, não foram identificados pecados claros. Continue perseverando no caminho da virtude e na vigilância."
-        else:
-            texto_consolidado = ""
-            for pecado in pecados_identificados:
-                texto_consolidado += f"Pergunta: {pecado['pergunta']}\nResposta: {pecado['resposta']}\n\n"
-            
-            prompt_final = f"""
+    # Devolve a próxima pergunta e o progresso, para que o cliente não precise recarregar o estado inteiro
+    respondidas = ids_respondidos(session_id)
+    progresso = {"answered": len(respondidas & mapa_perguntas.keys()), "total": len(mapa_perguntas)}
+    next_question = proxima_pergunta(respondidas)
+    resposta = {"message": "Resposta salva com sucesso.", "cursor": cursor, "session_id": session_id, "progress": progresso}
+    if next_question is None:
+        resposta.update(status="completed", history=[])
+    else:
+        resposta.update(status="in_progress", next_question=next_question, history=[mensagem_pergunta(next_question, datetime.now().isoformat())])
+    return jsonify(resposta)
+
+ANALISE_SEM_PECADOS = "Análise concluída. Com base em suas respostas, não foram identificados pecados claros. Continue perseverando no caminho da virtude e na vigilância."
+
+def classificar_exame_atual():
+    """Classifica o exame em andamento e retorna (classificacoes, pecados_identificados)."""
+    _, perguntas_data = carregar_catalogo()
+    respostas_data = carregar_respostas_salvas()
+
+    # As respostas já foram classificadas durante o exame; aqui só esperamos as que ainda estão na fila
+    with cronometrar("analyze_exam", "wait_speculative"):
+        wait_for_pending(timeout=CLASSIFICATION_WAIT_TIMEOUT)
+    with cronometrar("analyze_exam", "classification"):
+        classificacoes = classify_exam(respostas_data, perguntas_data)
+
+    pecados_identificados = []
+    for resp in respostas_data:
+        question_id = resp['id_pergunta']
+        if classificacoes.get(question_id) == 1:
+            pecados_identificados.append({"pergunta": perguntas_data[question_id]['texto'], "resposta": resp['resposta']})
+    return classificacoes, pecados_identificados
+
+def montar_prompt_analise(pecados_identificados):
+    texto_consolidado = ""
+    for pecado in pecados_identificados:
+        texto_consolidado += f"Pergunta: {pecado['pergunta']}\nResposta: {pecado['resposta']}\n\n"
+
+    return f"""
             A seguir estão as respostas de um exame de consciência onde o usuário indicou ter cometido um pecado. 
             Sua tarefa é analisar essas quedas com sensibilidade e profundidade espiritual, focando em padrões de comportamento e áreas que necessitam de mais atenção.
             Ofereça uma reflexão construtiva e encorajadora sobre esses pontos, sugerindo um ou dois pontos práticos para o desenvolvimento espiritual.
@@ -204,32 +311,204 @@ def analyze_exam():
 
             Análise e Reflexão:
             """
-            
-            # ===== MUDANÇA 1: Controle do LLM (stop e num_predict) =====
-            llm_textual_analyzer = OllamaLLM(
-                model=LLM_MODEL_NAME,
-                num_predict=1024,  # Limita a resposta a 1024 tokens
-                stop=["###", "Instruction:"] # Para de gerar se encontrar esses termos
-            )
-            # ==========================================================
 
-            analise_bruta = llm_textual_analyzer.invoke(prompt_final)
+# ===== MUDANÇA 1: Controle do LLM (stop e num_predict) =====
+# Limite de 1024 tokens e parada em "###"/"Instruction:" ficam no papel "analyzer" de llm_clients.py
+def get_textual_analyzer():
+    return get_llm("analyzer")
+# ==========================================================
+
+def iniciar_salvamento_progresso(classificacoes):
+    """Grava o progresso em segundo plano e retorna o id da tarefa (acompanhado em /api/jobs/<id>)."""
+    print("Iniciando a tarefa de salvamento de progresso em background...")
+    return iniciar_job("progress", analyze_and_store_exam, classificacoes=classificacoes, perguntas_data=carregar_catalogo()[1])
 
-            # ===== MUDANÇA 2: Medida de Segurança para Cortar a Saída =====
-            # Corta a string no primeiro "###" que encontrar e limpa espaços
-            analise_textual = analise_bruta.split("###")[0].strip()
-            # ==============================================================
+def cortar_no_marcador(chunks, marcador="###"):
+    """
+    Versão incremental do corte por "###": repassa os pedaços gerados pelo LLM
+    até encontrar o marcador, segurando apenas o final que ainda pode ser o início dele.
+    Espaços no início da resposta são descartados, como no .strip() da versão sem streaming.
+    """
+    pendente, iniciou = "", False
+    for chunk in chunks:
+        pendente += chunk
+        if not iniciou:
+            pendente = pendente.lstrip()
+            iniciou = bool(pendente)
+        posicao = pendente.find(marcador)
+        if posicao != -1:
+            if pendente[:posicao]:
+                yield pendente[:posicao]
+            return
+        # Segura o sufixo que pode ser o começo do marcador
+        seguro = len(pendente)
+        for tamanho in range(min(len(marcador) - 1, len(pendente)), 0, -1):
+            if marcador.startswith(pendente[-tamanho:]):
+                seguro = len(pendente) - tamanho
+                break
+        if seguro:
+            yield pendente[:seguro]
+            pendente = pendente[seguro:]
+    if pendente:
+        yield pendente
 
-        print("Iniciando a tarefa de salvamento de progresso em background...")
-        thread = threading.Thread(target=analyze_and_store_exam_with_lock)
-        thread.start()
+def sse_event(event, data):
+    """Formata um evento Server-Sent Events com o payload em JSON."""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@app.route('/api/exame/analyze', methods=['POST'])
+def analyze_exam():
+    try:
+        with cronometrar("analyze_exam", "total"):
+            classificacoes, pecados_identificados = classificar_exame_atual()
+
+            if not pecados_identificados:
+                analise_textual = ANALISE_SEM_PECADOS
+            else:
+                with vaga_llm(), cronometrar("analyze_exam", "generation"):
+                    analise_bruta = get_textual_analyzer().invoke(montar_prompt_analise(pecados_identificados))
+
+                # ===== MUDANÇA 2: Medida de Segurança para Cortar a Saída =====
+                # Corta a string no primeiro "###" que encontrar e limpa espaços
+                analise_textual = analise_bruta.split("###")[0].strip()
+                # ==============================================================
+
+        job_id = iniciar_salvamento_progresso(classificacoes)
         
-        return jsonify({"analysis": analise_textual})
+        return jsonify({"analysis": analise_textual, "job_id": job_id})
 
+    except ServidorOcupado:
+        return resposta_ocupado()
     except Exception as e:
         print(f"Erro na análise principal: {e}")
         return jsonify({"error": "Falha ao gerar a análise."}), 500
 
+@app.route('/api/exame/analyze/stream', methods=['POST'])
+def analyze_exam_stream():
+    """Versão em streaming (SSE) da análise: eventos 'token' com o texto parcial e 'done' com a análise completa."""
+    def gerar():
+        try:
+            classificacoes, pecados_identificados = classificar_exame_atual()
+            if not pecados_identificados:
+                analise_textual = ANALISE_SEM_PECADOS
+                yield sse_event("token", {"text": analise_textual})
+            else:
+                partes = []
+                with vaga_llm(), cronometrar("analyze_exam", "generation"):
+                    chunks = get_textual_analyzer().stream(montar_prompt_analise(pecados_identificados))
+                    for parte in cortar_no_marcador(chunks):
+                        partes.append(parte)
+                        yield sse_event("token", {"text": parte})
+                analise_textual = "".join(partes).strip()
+
+            job_id = iniciar_salvamento_progresso(classificacoes)
+            yield sse_event("done", {"analysis": analise_textual, "job_id": job_id})
+        except ServidorOcupado as e:
+            yield sse_event("error", {"error": str(e), "retry_after": LLM_QUEUE_TIMEOUT})
+        except Exception as e:
+            print(f"Erro na análise principal (streaming): {e}")
+            yield sse_event("error", {"error": "Falha ao gerar a análise."})
+
+    return Response(stream_with_context(gerar()), mimetype='text/event-stream', headers={"Cache-Control": "no-cache"})
+
+def formatar_fontes(source_documents):
+    sources = []
+    for doc in source_documents or []:
+        source_name = os.path.basename(doc.metadata.get('source', 'desconhecida'))
+        page_num = doc.metadata.get('page', 'N/A')
+        sources.append(f"{source_name} (pág. {page_num})")
+    return ", ".join(list(set(sources))) if sources else "Nenhuma fonte encontrada."
+
+def versao_do_indice():
+    """
+    Identifica a versão do índice em disco. É lida uma vez em carregar_rag: o índice em memória
+    não é recarregado, então as respostas em cache usam a versão que foi de fato carregada.
+    """
+    partes = []
+    for nome in ("index.faiss", "index.pkl"):
+        caminho = os.path.join(RAG_INDEX_PATH, nome)
+        if os.path.exists(caminho):
+            info = os.stat(caminho)
+            partes.append(f"{nome}:{info.st_mtime_ns}:{info.st_size}")
+    return "|".join(partes)
+
+def buscar_lexical(pergunta):
+    """Busca BM25 no índice lexical salvo junto ao FAISS; retorna os documentos do docstore em ordem."""
+    if rag_lexical is None:
+        return []
+    # A conexão é compartilhada pelas threads do servidor; as consultas levam poucos milissegundos
+    with _lexical_lock:
+        resultados = buscar_bm25(rag_lexical, pergunta, k=RAG_FETCH_K)
+    documentos = [rag_vector_store.docstore.search(doc_id) for doc_id, _ in resultados]
+    return [doc for doc in documentos if not isinstance(doc, str)]
+
+def recuperar_documentos(pergunta, vetor):
+    """
+    Busca trechos da pergunta no índice FAISS (diversificados por MMR) e no índice BM25,
+    funde as duas listas por Reciprocal Rank Fusion e prepara o resultado para o prompt
+    (junção de vizinhos, remoção de repetições e limite de tokens).
+    """
+    with cronometrar("rag_query", "vector_search"):
+        try:
+            candidatos = rag_vector_store.max_marginal_relevance_search_by_vector(
+                vetor, k=RAG_TOP_K, fetch_k=RAG_FETCH_K, lambda_mult=RAG_MMR_LAMBDA
+            )
+        except RuntimeError as e:
+            # Alguns índices derivados não permitem reconstruir vetores, o que o MMR exige
+            print(f"MMR indisponível para o índice atual ({e}). Usando busca por similaridade.")
+            candidatos = rag_vector_store.similarity_search_by_vector(vetor, k=RAG_TOP_K)
+
+    with cronometrar("rag_query", "lexical_search"):
+        lexicais = buscar_lexical(pergunta)
+    if lexicais:
+        por_conteudo = {doc.page_content: doc for doc in lexicais + candidatos}
+        ordem = fundir_por_rrf([[d.page_content for d in candidatos], [d.page_content for d in lexicais]])
+        candidatos = [por_conteudo[conteudo] for conteudo in ordem[:RAG_TOP_K]]
+
+    with cronometrar("rag_query", "context"):
+        documentos, _ = montar_contexto(candidatos)
+    return documentos
+
+def montar_prompt_rag(pergunta, source_documents):
+    contexto = "\n\n".join(doc.page_content for doc in source_documents)
+    return rag_prompt.format(context=contexto, question=pergunta)
+
+def buscar_no_cache_rag(pergunta):
+    """
+    Consulta o cache de respostas: primeiro pela pergunta exata e depois por perguntas
+    semelhantes. Retorna (resposta_em_cache, vetor_da_pergunta, versao_do_indice_carregado).
+    """
+    versao = rag_index_version
+    with cronometrar("rag_query", "cache_exact"):
+        resposta = buscar_resposta_exata(pergunta, versao)
+    if resposta:
+        print("Cache do RAG: resposta encontrada para a mesma pergunta.")
+        incrementar("inspectorum_rag_cache_total", result="exact")
+        return resposta, None, versao
+    with cronometrar("rag_query", "embedding"):
+        vetor = rag_embeddings.embed_query(pergunta)
+    with cronometrar("rag_query", "cache_similar"):
+        resposta = buscar_resposta_semelhante(vetor, versao)
+    incrementar("inspectorum_rag_cache_total", result="similar" if resposta else "miss")
+    return resposta, vetor, versao
+
+def responder_pergunta_rag(pergunta):
+    """Responde uma pergunta do assistente de doutrina, usando o cache e agrupando perguntas simultâneas."""
+    carregar_rag()
+    resposta, vetor, versao = buscar_no_cache_rag(pergunta)
+    if resposta:
+        return resposta
+
+    def gerar():
+        source_documents = recuperar_documentos(pergunta, vetor)
+        with vaga_llm(), cronometrar("rag_query", "generation"):
+            answer = rag_llm.invoke(montar_prompt_rag(pergunta, source_documents)).strip()
+        resultado = {"answer": answer, "sources": formatar_fontes(source_documents)}
+        salvar_resposta(pergunta, vetor, resultado["answer"], resultado["sources"], versao)
+        return resultado
+
+    return coalesce(pergunta, gerar)
+
 @app.route('/api/rag/query', methods=['POST'])
 def rag_query():
     try:
@@ -237,56 +516,118 @@ def rag_query():
         if not user_question:
             return jsonify({"error": "Nenhuma pergunta fornecida."}), 400
         
-        chain = get_rag_chain()
-        result = chain.invoke({"query": user_question})
-        
-        answer = result.get("result", "Não foi possível gerar uma resposta.")
-        
-        sources = []
-        if result.get("source_documents"):
-            for doc in result["source_documents"]:
-                source_name = os.path.basename(doc.metadata.get('source', 'desconhecida'))
-                page_num = doc.metadata.get('page', 'N/A')
-                sources.append(f"{source_name} (pág. {page_num})")
-        
-        sources_text = ", ".join(list(set(sources))) if sources else "Nenhuma fonte encontrada."
-        return jsonify({"answer": answer, "sources": sources_text})
-        
+        with cronometrar("rag_query", "total"):
+            resultado = responder_pergunta_rag(user_question)
+        return jsonify({"answer": resultado["answer"] or "Não foi possível gerar uma resposta.", "sources": resultado["sources"]})
+
+    except ServidorOcupado:
+        return resposta_ocupado()
     except Exception as e:
         print(f"Erro na consulta RAG: {e}")
         return jsonify({"error": "Falha ao processar a pergunta com o RAG."}), 500
 
+@app.route('/api/rag/query/stream', methods=['POST'])
+def rag_query_stream():
+    """Versão em streaming (SSE) do RAG: eventos 'token' durante a geração e 'sources' ao final."""
+    user_question = (request.json or {}).get('question')
+    if not user_question:
+        return jsonify({"error": "Nenhuma pergunta fornecida."}), 400
+
+    def gerar():
+        try:
+            carregar_rag()
+            resposta, vetor, versao = buscar_no_cache_rag(user_question)
+            if resposta is None:
+                future, lider = iniciar_geracao(user_question)
+                if not lider:
+                    # Outra requisição já está gerando a mesma pergunta: aguarda o resultado dela
+                    resposta = future.result()
+
+            if resposta is not None:
+                yield sse_event("token", {"text": resposta["answer"]})
+                yield sse_event("sources", resposta)
+                return
+
+            try:
+                source_documents = recuperar_documentos(user_question, vetor)
+                partes = []
+                with vaga_llm(), cronometrar("rag_query", "generation"):
+                    for parte in cortar_no_marcador(rag_llm.stream(montar_prompt_rag(user_question, source_documents))):
+                        partes.append(parte)
+                        yield sse_event("token", {"text": parte})
+
+                resultado = {"answer": "".join(partes).strip(), "sources": formatar_fontes(source_documents)}
+                salvar_resposta(user_question, vetor, resultado["answer"], resultado["sources"], versao)
+            except BaseException as e:
+                # GeneratorExit (cliente desconectou) não deve ser repassado às requisições em espera
+                erro = e if isinstance(e, Exception) else RuntimeError("Geração interrompida.")
+                concluir_geracao(user_question, future, erro=erro)
+                raise
+            concluir_geracao(user_question, future, resultado=resultado)
+            yield sse_event("sources", resultado)
+        except ServidorOcupado as e:
+            yield sse_event("error", {"error": str(e), "retry_after": LLM_QUEUE_TIMEOUT})
+        except Exception as e:
+            print(f"Erro na consulta RAG (streaming): {e}")
+            yield sse_event("error", {"error": "Falha ao processar a pergunta com o RAG."})
+
+    return Response(stream_with_context(gerar()), mimetype='text/event-stream', headers={"Cache-Control": "no-cache"})
+
 # --- ROTAS DO DASHBOARD E OUTRAS FUNÇÕES ---
-def get_consecutive_days(dates):
-    if not dates: return 0
-    date_objects = sorted(list(set(date.fromisoformat(d[0]) for d in dates)))
-    if not date_objects: return 0
-    today = date.today()
-    if today - date_objects[-1] > timedelta(days=1): return 0
-    consecutive_count = 1
-    for i in range(len(date_objects) - 1, 0, -1):
-        if date_objects[i] - date_objects[i-1] == timedelta(days=1):
-            consecutive_count += 1
-        else:
-            break
-    return consecutive_count
+def get_consecutive_days(cursor):
+    """Dias consecutivos com exame até hoje (ou até ontem, se hoje ainda não houve exame)."""
+    cursor.execute("SELECT exam_date, streak FROM daily_summary ORDER BY exam_date DESC LIMIT 1")
+    ultimo = cursor.fetchone()
+    if not ultimo: return 0
+    if date.today() - date.fromisoformat(ultimo[0]) > timedelta(days=1): return 0
+    return ultimo[1]
 
 @app.route('/api/dashboard/status', methods=['GET'])
 def get_dashboard_status():
-    if os.path.exists(LOCK_FILE_PATH):
-        return jsonify({"status": "processing"})
+    job = job_ativo("progress")
+    if job:
+        return jsonify({"status": "processing", "job": job})
     else:
         return jsonify({"status": "idle"})
 
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job_status(job_id):
+    """
+    Estado de uma tarefa em segundo plano. Com '?version=N', a requisição fica aberta (até 'wait'
+    segundos) até que a tarefa mude em relação à versão N ou termine, evitando polling curto.
+    """
+    try:
+        versao = int(request.args.get('version', -1))
+        espera = float(request.args.get('wait', JOB_MAX_WAIT))
+    except ValueError:
+        return jsonify({"error": "Parâmetros 'version' e 'wait' devem ser numéricos."}), 400
+    job = aguardar_job(job_id, versao, espera)
+    if job is None:
+        return jsonify({"error": "Tarefa não encontrada."}), 404
+    return jsonify(job)
+
+def dashboard_etag(cursor):
+    """O dashboard só muda quando o resumo diário é atualizado ou quando o dia vira."""
+    cursor.execute("SELECT COUNT(*), MAX(updated_at) FROM daily_summary")
+    total, ultima_atualizacao = cursor.fetchone()
+    return hash_texto(f"{date.today().isoformat()}|{total}|{ultima_atualizacao}")[:32]
+
 @app.route('/api/dashboard/progress', methods=['GET'])
 def get_progress_data():
     try:
-        conn = sqlite3.connect(DATABASE_NAME)
-        cursor = conn.cursor()
-        
-        seven_days_ago = (date.today() - timedelta(days=6)).isoformat()
-        cursor.execute("SELECT exam_date, SUM(is_sin), COUNT(is_sin) FROM progress WHERE exam_date >= ? GROUP BY exam_date ORDER BY exam_date ASC", (seven_days_ago,))
-        weekly_data = cursor.fetchall()
+        with conexao() as conn:
+            cursor = conn.cursor()
+            etag = dashboard_etag(cursor)
+            if request.if_none_match.contains(etag):
+                return Response(status=304, headers={"ETag": f'"{etag}"'})
+
+            seven_days_ago = (date.today() - timedelta(days=6)).isoformat()
+            cursor.execute("SELECT exam_date, sins, total FROM daily_summary WHERE exam_date >= ? ORDER BY exam_date ASC", (seven_days_ago,))
+            weekly_data = cursor.fetchall()
+            cursor.execute("SELECT COUNT(*) FROM daily_summary")
+            total_sessions = cursor.fetchone()[0]
+            consecutive_days = get_consecutive_days(cursor)
+
         chart_data, date_map = [], {d[0]: {'sins': d[1], 'virtues': d[2] - d[1]} for d in weekly_data}
         for i in range(7):
             day = date.today() - timedelta(days=i)
@@ -294,18 +635,8 @@ def get_progress_data():
             chart_data.append({'day': day.strftime('%a'), 'sins': data_point['sins'], 'virtues': data_point['virtues']})
         chart_data.reverse()
 
-        cursor.execute("SELECT COUNT(DISTINCT exam_date) FROM progress")
-        total_sessions = cursor.fetchone()[0]
-        cursor.execute("SELECT exam_date FROM progress ORDER BY exam_date DESC")
-        all_dates = cursor.fetchall()
-        consecutive_days = get_consecutive_days(all_dates)
-
-        today_str = date.today().isoformat()
-        yesterday_str = (date.today() - timedelta(days=1)).isoformat()
-        cursor.execute("SELECT SUM(is_sin) FROM progress WHERE exam_date = ?", (today_str,))
-        today_sins = cursor.fetchone()[0] or 0
-        cursor.execute("SELECT SUM(is_sin) FROM progress WHERE exam_date = ?", (yesterday_str,))
-        yesterday_sins = cursor.fetchone()[0] or 0
+        today_sins = date_map.get(date.today().isoformat(), {'sins': 0})['sins']
+        yesterday_sins = date_map.get((date.today() - timedelta(days=1)).isoformat(), {'sins': 0})['sins']
         
         daily_improvement = 0
         if yesterday_sins > 0:
@@ -315,8 +646,7 @@ def get_progress_data():
             daily_improvement = 0
         else:
             daily_improvement = -100
-        conn.close()
-        return jsonify({
+        response = jsonify({
             "chartData": chart_data,
             "summary": {
                 "totalSessions": total_sessions or 0,
@@ -324,9 +654,88 @@ def get_progress_data():
                 "consecutiveDays": consecutive_days or 0
             }
         })
+        response.set_etag(etag)
+        return response
     except Exception as e:
         print(f"Erro ao buscar dados do dashboard: {e}")
         return jsonify({"error": "Falha ao buscar dados de progresso."}), 500
 
+@app.route('/api/dashboard/categories', methods=['GET'])
+def get_category_trends():
+    """
+    Pecados e respostas por categoria, agrupados por dia, semana ou mês, a partir das agregações
+    materializadas. Parâmetros: granularity, start, end (YYYY-MM-DD), page e page_size.
+    Os períodos vêm do mais recente para o mais antigo.
+    """
+    granularidade = request.args.get('granularity', 'week')
+    if granularidade not in ROLLUP_GRANULARIDADES:
+        return jsonify({"error": f"granularity deve ser um de: {', '.join(ROLLUP_GRANULARIDADES)}."}), 400
+    try:
+        inicio = request.args.get('start')
+        fim = request.args.get('end', date.today().isoformat())
+        # O filtro compara o início de cada período, então 'start' é alinhado ao período que o contém
+        inicio = inicio_do_periodo(inicio, granularidade) if inicio else '0000-01-01'
+        fim = date.fromisoformat(fim).isoformat()
+        pagina = max(1, int(request.args.get('page', 1)))
+        tamanho = min(TRENDS_MAX_PAGE_SIZE, max(1, int(request.args.get('page_size', TRENDS_PAGE_SIZE))))
+    except ValueError:
+        return jsonify({"error": "Parâmetros inválidos: use datas no formato YYYY-MM-DD e números inteiros para a paginação."}), 400
+
+    try:
+        with conexao() as conn:
+            cursor = conn.cursor()
+            filtro = "granularity = ? AND period_start BETWEEN ? AND ?"
+            cursor.execute(f"SELECT COUNT(DISTINCT period_start) FROM category_rollup WHERE {filtro}", (granularidade, inicio, fim))
+            total_periodos = cursor.fetchone()[0]
+
+            cursor.execute(
+                f"SELECT DISTINCT period_start FROM category_rollup WHERE {filtro} ORDER BY period_start DESC LIMIT ? OFFSET ?",
+                (granularidade, inicio, fim, tamanho, (pagina - 1) * tamanho)
+            )
+            periodos = [row[0] for row in cursor.fetchall()]
+
+            itens = {periodo: [] for periodo in periodos}
+            if periodos:
+                cursor.execute(
+                    f"SELECT period_start, categoria, sins, total FROM category_rollup WHERE granularity = ? AND period_start IN ({','.join('?' * len(periodos))}) ORDER BY categoria",
+                    (granularidade, *periodos)
+                )
+                for periodo, categoria, sins, total in cursor.fetchall():
+                    itens[periodo].append({"categoria": categoria, "sins": sins, "virtues": total - sins, "total": total})
+
+        return jsonify({
+            "granularity": granularidade,
+            "items": [{"period": periodo, "categories": categorias} for periodo, categorias in itens.items()],
+            "page": pagina,
+            "page_size": tamanho,
+            "total_periods": total_periodos,
+            "has_more": pagina * tamanho < total_periodos
+        })
+    except Exception as e:
+        print(f"Erro ao buscar tendências por categoria: {e}")
+        return jsonify({"error": "Falha ao buscar tendências por categoria."}), 500
+
+@app.route('/api/metrics', methods=['GET'])
+def get_metrics():
+    """Métricas do processo no formato de texto do Prometheus (latência por etapa, tokens e durações do Ollama)."""
+    return Response(exportar_metricas(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+def encerrar_recursos(timeout=30):
+    """
+    Encerramento gracioso: espera as tarefas de salvamento e as classificações em andamento
+    (até 'timeout' segundos) e fecha as conexões do pool. Chamado por serve.py ao receber SIGINT/SIGTERM.
+    """
+    print("Encerrando: aguardando tarefas em segundo plano...")
+    aguardar_jobs_ativos(timeout)
+    encerrar_classificacoes(timeout)
+    fechar_conexoes()
+    if rag_lexical is not None:
+        rag_lexical.close()
+    print("Recursos liberados.")
+
+if WARMUP_ON_START:
+    iniciar_aquecimento()
+
 if __name__ == '__main__':
+    # Servidor de desenvolvimento. Para uso contínuo, rode 'python serve.py' (ver README).
     app.run(debug=True, port=5000)
\ No newline at end of file
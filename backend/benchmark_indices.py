@@ -0,0 +1,119 @@
+"""
+Compara os tipos de índice FAISS (flat, hnsw, ivfpq, sq8, fp16) do assistente de doutrina.
+
+Para cada tipo disponível em 'faiss_index_mistral', mede em um processo separado:
+  - tempo de carga do índice (mapeado em memória, ou lido inteiro com --sem-mmap);
+  - memória residente após a carga (psutil ou, fora do Windows, o módulo resource;
+    sem nenhum dos dois a coluna aparece como "n/d");
+  - latência das consultas (p50/p95) e recall@k em relação ao índice flat (busca exata).
+
+As consultas são vetores do próprio índice com um pequeno ruído, o que dispensa carregar
+o modelo de embeddings. Exemplo de uso (na pasta 'backend'):
+
+    python benchmark_indices.py --gerar hnsw,ivfpq,sq8,fp16 --consultas 200 --k 4
+"""
+import os
+import sys
+import json
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import faiss
+from rag_engineering import INDEX_PATH, INDEX_TYPES, caminho_indice, ler_indice, salvar_indices_derivados, HNSW_EF_SEARCH, IVF_NPROBE
+
+def memoria_residente():
+    """
+    Memória residente do processo atual em bytes (psutil se disponível, senão o pico do processo).
+    Retorna None quando nenhum dos dois existe (Windows sem psutil).
+    """
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return pico if sys.platform == "darwin" else pico * 1024
+
+def gerar_consultas(index_path, quantidade, semente=42):
+    flat = faiss.read_index(caminho_indice(index_path, "flat"))
+    rng = np.random.default_rng(semente)
+    ids = rng.choice(flat.ntotal, size=min(quantidade, flat.ntotal), replace=False)
+    vetores = np.stack([flat.reconstruct(int(i)) for i in ids]).astype(np.float32)
+    ruido = rng.normal(scale=0.05 * float(np.std(vetores)), size=vetores.shape).astype(np.float32)
+    return vetores + ruido
+
+def medir_tipo(index_path, index_type, consultas, k, mmap):
+    """Roda em um processo novo, para que a memória medida seja apenas a deste índice."""
+    memoria_antes = memoria_residente()
+    inicio = time.perf_counter()
+    index, mmap = ler_indice(caminho_indice(index_path, index_type), mmap)
+    tempo_carga = time.perf_counter() - inicio
+    memoria_depois = memoria_residente()
+
+    if hasattr(index, "hnsw"):
+        index.hnsw.efSearch = HNSW_EF_SEARCH
+    elif isinstance(index, faiss.IndexIVF):
+        index.nprobe = IVF_NPROBE
+
+    latencias, resultados = [], []
+    for consulta in consultas:
+        inicio = time.perf_counter()
+        _, ids = index.search(consulta.reshape(1, -1), k)
+        latencias.append((time.perf_counter() - inicio) * 1000)
+        resultados.append(ids[0].tolist())
+
+    return {
+        "tipo": index_type,
+        "mmap": mmap,
+        "tamanho_arquivo_mb": os.path.getsize(caminho_indice(index_path, index_type)) / 2**20,
+        "tempo_carga_s": tempo_carga,
+        "memoria_residente_mb": None if memoria_antes is None else (memoria_depois - memoria_antes) / 2**20,
+        "latencia_p50_ms": float(np.percentile(latencias, 50)),
+        "latencia_p95_ms": float(np.percentile(latencias, 95)),
+        "resultados": resultados,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de recall e latência dos tipos de índice FAISS.")
+    parser.add_argument("--index-path", default=INDEX_PATH)
+    parser.add_argument("--gerar", default="", help="tipos derivados a gerar antes do benchmark, separados por vírgula")
+    parser.add_argument("--consultas", type=int, default=200)
+    parser.add_argument("--k", type=int, default=4)
+    parser.add_argument("--sem-mmap", action="store_true", help="lê os índices inteiros em vez de mapeá-los em memória")
+    parser.add_argument("--json", help="arquivo onde salvar os resultados")
+    args = parser.parse_args()
+
+    if args.gerar:
+        flat = faiss.read_index(caminho_indice(args.index_path, "flat"))
+        salvar_indices_derivados(flat, args.index_path, [t.strip() for t in args.gerar.split(",") if t.strip()])
+        del flat
+
+    tipos = [t for t in INDEX_TYPES if os.path.exists(caminho_indice(args.index_path, t))]
+    consultas = gerar_consultas(args.index_path, args.consultas)
+
+    resultados = []
+    for index_type in tipos:
+        with ProcessPoolExecutor(max_workers=1) as executor:
+            resultados.append(executor.submit(medir_tipo, args.index_path, index_type, consultas, args.k, not args.sem_mmap).result())
+
+    exato = next(r["resultados"] for r in resultados if r["tipo"] == "flat")
+    print(f"\n{'tipo':<7}{'arquivo MB':>11}{'carga s':>9}{'RSS MB':>9}{'p50 ms':>9}{'p95 ms':>9}{f'recall@{args.k}':>11}")
+    for r in resultados:
+        acertos = sum(len(set(a) & set(b)) for a, b in zip(r.pop("resultados"), exato))
+        r["recall"] = acertos / (len(exato) * args.k)
+        memoria = "n/d" if r["memoria_residente_mb"] is None else f"{r['memoria_residente_mb']:.1f}"
+        print(f"{r['tipo']:<7}{r['tamanho_arquivo_mb']:>11.1f}{r['tempo_carga_s']:>9.3f}{memoria:>9}"
+              f"{r['latencia_p50_ms']:>9.3f}{r['latencia_p95_ms']:>9.3f}{r['recall']:>11.3f}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"k": args.k, "consultas": len(consultas), "resultados": resultados}, f, indent=2)
+        print(f"\nResultados salvos em '{args.json}'.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,416 @@
+"""
+Benchmark do backend com um substituto local do Ollama.
+
+Em um diretório temporário, o script:
+  - sobe um servidor HTTP que imita a API do Ollama (/api/generate, /api/tags, /api/ps),
+    com latência configurável por token e saídas determinísticas (JSON de classificação
+    ou texto), de modo que os resultados não dependem do modelo nem da máquina do Ollama;
+  - gera um progress.db sintético com anos de histórico e uma sessão de exame aberta;
+  - gera PDFs de teste e constrói com eles um índice pequeno (build_index);
+  - mede vazão e latência (p50/p95) de /api/exame/analyze, /api/rag/query,
+    /api/dashboard/progress e build_index, além da média de cada etapa instrumentada.
+
+Por padrão os embeddings são determinísticos (hash das palavras), para não baixar o modelo
+de embeddings; use --embeddings-reais para medir com o modelo de verdade. Os caches de
+classificação e de respostas do RAG são limpos antes de cada requisição (caminho frio).
+Exemplo de uso (na pasta 'backend'):
+
+    python benchmark_servidor.py --latencia-token-ms 20 --anos 3 --json resultado.json
+    python benchmark_servidor.py --json novo.json --comparar resultado.json
+"""
+import os
+import re
+import sys
+import json
+import time
+import math
+import random
+import shutil
+import hashlib
+import argparse
+import tempfile
+import threading
+from datetime import date, datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+import yaml
+
+DIRETORIO_BACKEND = os.path.dirname(os.path.abspath(__file__))
+DIMENSAO_EMBEDDING_FALSO = 384
+
+VOCABULARIO = (
+    "graca oracao caridade virtude pecado perdao misericordia fe esperanca humildade paciencia "
+    "justica prudencia temperanca fortaleza sacramento confissao eucaristia penitencia conversao "
+    "alma consciencia mandamento santidade vigilancia tentacao obediencia pobreza castidade trabalho "
+    "familia proximo verdade mentira inveja soberba ira preguica gula avareza silencio regra mosteiro "
+    "igreja evangelho escritura santo doutrina amor deus cristo espirito vida cruz salvacao liturgia jejum"
+).split()
+
+# --- SUBSTITUTO DO OLLAMA ---
+def _semente(*partes):
+    return int(hashlib.sha256("\x1f".join(partes).encode("utf-8")).hexdigest(), 16)
+
+def resposta_deterministica(prompt, formato, limite_tokens, tokens_resposta):
+    """Lista de pedaços ("tokens") que o substituto devolve para o prompt."""
+    if not prompt:
+        return []
+    if formato == "json":
+        # Prompt em lote: um id por item depois do exemplo; prompt individual: {"pecado": 0/1}
+        pares = prompt.split("Agora, analise os seguintes pares:")[-1] if "Agora, analise" in prompt else ""
+        ids = re.findall(r"\[([^\]]+)\] Pergunta:", pares)
+        saida = {i: _semente(i, pares) % 2 for i in ids} if ids else {"pecado": _semente(prompt) % 2}
+        texto = json.dumps(saida)
+        return [texto[i:i + 4] for i in range(0, len(texto), 4)]
+    quantidade = tokens_resposta if not limite_tokens or limite_tokens < 0 else min(tokens_resposta, limite_tokens)
+    rng = random.Random(_semente(prompt))
+    return [rng.choice(VOCABULARIO) + " " for _ in range(quantidade)]
+
+class _FakeOllamaHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def _enviar_json(self, dados, status=200):
+        corpo = json.dumps(dados).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(corpo)))
+        self.end_headers()
+        self.wfile.write(corpo)
+
+    def _modelo(self):
+        return {"name": self.server.modelo, "model": self.server.modelo, "modified_at": datetime.now().isoformat(),
+                "size": 2_300_000_000, "digest": "0" * 64, "details": {"family": "phi3", "parameter_size": "3.8B"}}
+
+    def do_GET(self):
+        if self.path == "/api/tags":
+            self._enviar_json({"models": [self._modelo()]})
+        elif self.path == "/api/ps":
+            self._enviar_json({"models": [dict(self._modelo(), size_vram=0, expires_at=(datetime.now() + timedelta(minutes=30)).isoformat())]})
+        elif self.path == "/api/version":
+            self._enviar_json({"version": "0.0.0-benchmark"})
+        else:
+            self._enviar_json({"error": "not found"}, 404)
+
+    def do_POST(self):
+        corpo = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or b"{}")
+        if self.path != "/api/generate":
+            self._enviar_json({"error": "not found"}, 404)
+            return
+        with self.server.lock:
+            self.server.chamadas += 1
+
+        prompt = corpo.get("prompt") or ""
+        opcoes = corpo.get("options") or {}
+        tokens = resposta_deterministica(prompt, corpo.get("format"), opcoes.get("num_predict"), self.server.tokens_resposta)
+        prompt_tokens = len(prompt.split())
+        inicio = time.perf_counter_ns()
+        time.sleep(prompt_tokens / self.server.prompt_tokens_por_segundo)
+        duracao_prompt = time.perf_counter_ns() - inicio
+
+        base = {"model": self.server.modelo, "created_at": datetime.now().isoformat()}
+        def final():
+            total = time.perf_counter_ns() - inicio
+            return dict(base, response="", done=True, done_reason="stop", context=[], total_duration=total,
+                        load_duration=0, prompt_eval_count=prompt_tokens, prompt_eval_duration=duracao_prompt,
+                        eval_count=len(tokens), eval_duration=total - duracao_prompt)
+
+        if not corpo.get("stream", True):
+            time.sleep(self.server.latencia_token * len(tokens))
+            self._enviar_json(dict(final(), response="".join(tokens)))
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.end_headers()
+        for token in tokens:
+            time.sleep(self.server.latencia_token)
+            self.wfile.write((json.dumps(dict(base, response=token, done=False)) + "\n").encode("utf-8"))
+            self.wfile.flush()
+        self.wfile.write((json.dumps(final()) + "\n").encode("utf-8"))
+
+class FakeOllama(ThreadingHTTPServer):
+    """Servidor HTTP que imita a API do Ollama, rodando em uma thread deste processo."""
+    daemon_threads = True
+
+    def __init__(self, modelo, latencia_token, prompt_tokens_por_segundo, tokens_resposta):
+        super().__init__(("127.0.0.1", 0), _FakeOllamaHandler)
+        self.modelo = modelo
+        self.latencia_token = latencia_token
+        self.prompt_tokens_por_segundo = prompt_tokens_por_segundo
+        self.tokens_resposta = tokens_resposta
+        self.chamadas = 0
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def iniciar(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+# --- DADOS SINTÉTICOS ---
+def escrever_pdf(caminho, paginas):
+    """Gera um PDF mínimo (fonte Helvetica, texto ASCII), com uma lista de linhas por página."""
+    def escapar(texto):
+        return texto.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+    objetos = {1: "<< /Type /Catalog /Pages 2 0 R >>", 3: "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"}
+    paginas_ref, proximo = [], 4
+    for linhas in paginas:
+        conteudo = "BT /F1 10 Tf 14 TL 40 800 Td " + " T* ".join(f"({escapar(l)}) Tj" for l in linhas) + " ET"
+        objetos[proximo] = f"<< /Length {len(conteudo)} >>\nstream\n{conteudo}\nendstream"
+        objetos[proximo + 1] = (f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+                                f"/Resources << /Font << /F1 3 0 R >> >> /Contents {proximo} 0 R >>")
+        paginas_ref.append(f"{proximo + 1} 0 R")
+        proximo += 2
+    objetos[2] = f"<< /Type /Pages /Kids [{' '.join(paginas_ref)}] /Count {len(paginas_ref)} >>"
+
+    saida, posicoes = bytearray(b"%PDF-1.4\n"), {}
+    for numero in sorted(objetos):
+        posicoes[numero] = len(saida)
+        saida += f"{numero} 0 obj\n{objetos[numero]}\nendobj\n".encode("latin-1")
+    inicio_xref, total = len(saida), max(objetos) + 1
+    saida += f"xref\n0 {total}\n0000000000 65535 f \n".encode("latin-1")
+    for numero in range(1, total):
+        saida += f"{posicoes[numero]:010d} 00000 n \n".encode("latin-1")
+    saida += f"trailer\n<< /Size {total} /Root 1 0 R >>\nstartxref\n{inicio_xref}\n%%EOF\n".encode("latin-1")
+    with open(caminho, "wb") as f:
+        f.write(saida)
+
+def gerar_documentos(pasta, quantidade, paginas, semente=7):
+    os.makedirs(pasta, exist_ok=True)
+    rng = random.Random(semente)
+    for i in range(quantidade):
+        conteudo = [[" ".join(rng.choice(VOCABULARIO) for _ in range(12)) for _ in range(52)] for _ in range(paginas)]
+        escrever_pdf(os.path.join(pasta, f"documento-{i + 1:02d}.pdf"), conteudo)
+
+def gerar_historico(anos, frequencia, taxa_pecado, categorias, semente=11):
+    """Preenche 'progress' com 'anos' de exames diários e monta o resumo diário e as agregações."""
+    from database import conexao, atualizar_resumo_diario, preencher_rollups_categoria
+    rng = random.Random(semente)
+    hoje = date.today()
+    datas = [(hoje - timedelta(days=d)).isoformat() for d in range(int(anos * 365), 0, -1) if rng.random() < frequencia]
+    linhas = [(d, qid, int(rng.random() < taxa_pecado)) for d in datas for qid in categorias]
+    with conexao() as conn:
+        cursor = conn.cursor()
+        cursor.executemany("INSERT INTO progress (exam_date, question_id, is_sin) VALUES (?, ?, ?)", linhas)
+        for exam_date in datas:
+            atualizar_resumo_diario(cursor, exam_date, recalcular_seguintes=False)
+    preencher_rollups_categoria(categorias)
+    return len(datas), len(linhas)
+
+def abrir_sessao_de_exame(perguntas, proporcao_livres, semente=13):
+    """Cria uma sessão aberta com todas as perguntas respondidas (sim/não ou texto livre, que vai ao LLM)."""
+    from session_store import encerrar_sessoes_abertas, criar_sessao, registrar_resposta
+    rng = random.Random(semente)
+    encerrar_sessoes_abertas()
+    criar_sessao()
+    livres = 0
+    for pergunta in perguntas:
+        if rng.random() < proporcao_livres:
+            livres += 1
+            resposta = f"Acho que falhei um pouco com a {rng.choice(VOCABULARIO)} nesta semana"
+        else:
+            resposta = rng.choice(["sim", "não"])
+        registrar_resposta(pergunta['id'], resposta)
+    return livres
+
+def perguntas_rag(quantidade, semente=17):
+    rng = random.Random(semente)
+    return [f"O que a doutrina ensina sobre {rng.choice(VOCABULARIO)} e {rng.choice(VOCABULARIO)}? ({i})" for i in range(quantidade)]
+
+def embeddings_deterministicos():
+    """Embeddings por hash das palavras: sem download de modelo e com semelhança lexical real."""
+    from langchain_core.embeddings import Embeddings
+
+    class EmbeddingsDeterministicos(Embeddings):
+        def __init__(self, model_name=None, **kwargs):
+            self.model_name = model_name
+
+        def _vetor(self, texto):
+            vetor = [0.0] * DIMENSAO_EMBEDDING_FALSO
+            for palavra in re.findall(r"\w+", texto.lower()):
+                h = _semente(palavra)
+                vetor[h % DIMENSAO_EMBEDDING_FALSO] += 1.0 if (h >> 20) % 2 else -1.0
+            norma = math.sqrt(sum(v * v for v in vetor)) or 1.0
+            return [v / norma for v in vetor]
+
+        def embed_documents(self, texts):
+            return [self._vetor(t) for t in texts]
+
+        def embed_query(self, text):
+            return self._vetor(text)
+
+    return EmbeddingsDeterministicos
+
+# --- MEDIÇÃO ---
+def medir(funcao, repeticoes, concorrencia=1, preparar=None):
+    """
+    Executa 'funcao(i)' 'repeticoes' vezes com até 'concorrencia' chamadas simultâneas.
+    'preparar(i)' roda antes de cada chamada e fica fora da latência (mas dentro do tempo total).
+    """
+    def uma(i):
+        if preparar:
+            preparar(i)
+        inicio = time.perf_counter()
+        ok = funcao(i)
+        return (time.perf_counter() - inicio) * 1000, ok
+
+    inicio_total = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concorrencia) as executor:
+        resultados = list(executor.map(uma, range(repeticoes)))
+    duracao_total = time.perf_counter() - inicio_total
+
+    latencias = [latencia for latencia, _ in resultados]
+    return {
+        "requisicoes": repeticoes,
+        "erros": sum(1 for _, ok in resultados if not ok),
+        "concorrencia": concorrencia,
+        "duracao_total_s": duracao_total,
+        "vazao_por_s": repeticoes / duracao_total if duracao_total else None,
+        "latencia_media_ms": float(np.mean(latencias)),
+        "latencia_p50_ms": float(np.percentile(latencias, 50)),
+        "latencia_p95_ms": float(np.percentile(latencias, 95)),
+    }
+
+def comparar(atual, anterior):
+    print(f"\nComparação com a execução anterior ({anterior.get('executado_em', '?')}):")
+    for nome, r in atual["resultados"].items():
+        antes = anterior.get("resultados", {}).get(nome)
+        if not antes:
+            continue
+        partes = []
+        for chave in ("latencia_p50_ms", "latencia_p95_ms"):
+            variacao = (r[chave] - antes[chave]) / antes[chave] * 100 if antes[chave] else 0.0
+            partes.append(f"{chave.split('_')[1]} {antes[chave]:.1f} -> {r[chave]:.1f} ms ({variacao:+.1f}%)")
+        print(f"  {nome:<20} " + " | ".join(partes))
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark do backend com um substituto local do Ollama.")
+    parser.add_argument("--latencia-token-ms", type=float, default=20.0, help="atraso do substituto por token gerado")
+    parser.add_argument("--prompt-tokens-por-segundo", type=float, default=500.0, help="velocidade simulada de avaliação do prompt")
+    parser.add_argument("--tokens-resposta", type=int, default=120, help="tokens gerados nas respostas em texto")
+    parser.add_argument("--anos", type=float, default=3.0, help="anos de histórico sintético no progress.db")
+    parser.add_argument("--frequencia", type=float, default=0.8, help="fração dos dias com exame no histórico")
+    parser.add_argument("--respostas-livres", type=float, default=0.5, help="fração das respostas do exame que precisam do LLM")
+    parser.add_argument("--pdfs", type=int, default=4)
+    parser.add_argument("--paginas", type=int, default=10)
+    parser.add_argument("--repeticoes", type=int, default=20, help="requisições por rota")
+    parser.add_argument("--repeticoes-analise", type=int, default=5)
+    parser.add_argument("--repeticoes-indice", type=int, default=3)
+    parser.add_argument("--concorrencia", type=int, default=1, help="requisições simultâneas em /api/rag/query e /api/dashboard/progress")
+    parser.add_argument("--embeddings-reais", action="store_true", help="usa o modelo de embeddings de verdade (baixa o modelo)")
+    parser.add_argument("--manter-diretorio", action="store_true", help="não apaga o diretório temporário ao final")
+    parser.add_argument("--json", help="arquivo onde salvar os resultados")
+    parser.add_argument("--comparar", help="JSON de uma execução anterior para comparar p50/p95")
+    args = parser.parse_args()
+
+    diretorio = tempfile.mkdtemp(prefix="inspectorum-bench-")
+    with open(os.path.join(DIRETORIO_BACKEND, "perguntas.yaml"), "r", encoding="utf-8") as f:
+        perguntas = yaml.safe_load(f)['perguntas']
+    shutil.copy(os.path.join(DIRETORIO_BACKEND, "perguntas.yaml"), diretorio)
+    os.chdir(diretorio)
+    print(f"Diretório de trabalho: {diretorio}")
+
+    ollama_falso = FakeOllama(None, args.latencia_token_ms / 1000, args.prompt_tokens_por_segundo, args.tokens_resposta).iniciar()
+    # llm_clients lê OLLAMA_HOST na importação, então a variável é definida antes de qualquer módulo do backend
+    os.environ["OLLAMA_HOST"] = ollama_falso.url
+    from llm_clients import LLM_MODEL_NAME
+    ollama_falso.modelo = LLM_MODEL_NAME
+    print(f"Substituto do Ollama em {ollama_falso.url} ({args.latencia_token_ms} ms/token).")
+
+    try:
+        from database import init_db, conexao
+        init_db()
+        categorias = {p['id']: p.get('categoria', "") for p in perguntas}
+        dias, linhas = gerar_historico(args.anos, args.frequencia, 0.2, categorias)
+        livres = abrir_sessao_de_exame(perguntas, args.respostas_livres)
+        print(f"Histórico sintético: {dias} dias, {linhas} linhas em 'progress'; exame aberto com {livres} respostas livres.")
+
+        import rag_engineering
+        if not args.embeddings_reais:
+            rag_engineering.HuggingFaceEmbeddings = embeddings_deterministicos()
+        gerar_documentos(rag_engineering.PDF_DIRECTORY_PATH, args.pdfs, args.paginas)
+
+        def construir_indice(_):
+            rag_engineering.build_index(incremental=False)
+            return os.path.exists(os.path.join(rag_engineering.INDEX_PATH, "index.faiss"))
+
+        def limpar_indice(_):
+            shutil.rmtree(rag_engineering.INDEX_PATH, ignore_errors=True)
+            if os.path.exists("embedding_cache.db"):
+                os.remove("embedding_cache.db")
+
+        resultados = {}
+        print(f"\nbuild_index ({args.pdfs} PDFs x {args.paginas} páginas)...")
+        resultados["build_index"] = medir(construir_indice, args.repeticoes_indice, preparar=limpar_indice)
+
+        import api_server
+        import job_manager
+        if not args.embeddings_reais:
+            api_server.HuggingFaceEmbeddings = rag_engineering.HuggingFaceEmbeddings
+        api_server.carregar_rag()
+        local = threading.local()
+
+        def cliente():
+            if not hasattr(local, "cliente"):
+                local.cliente = api_server.app.test_client()
+            return local.cliente
+
+        def requisitar(metodo, rota, **kwargs):
+            resposta = cliente().open(rota, method=metodo, buffered=True, **kwargs)
+            return resposta.status_code < 400
+
+        def limpar_tabela(tabela):
+            with conexao() as conn:
+                conn.execute(f"DELETE FROM {tabela}")
+
+        print("/api/exame/analyze...")
+        def preparar_analise(_):
+            job_manager.aguardar_jobs_ativos(120)
+            limpar_tabela("classification_cache")
+        resultados["exame_analyze"] = medir(lambda _: requisitar("POST", "/api/exame/analyze"), args.repeticoes_analise, preparar=preparar_analise)
+        job_manager.aguardar_jobs_ativos(120)
+
+        print("/api/rag/query...")
+        questoes = perguntas_rag(args.repeticoes)
+        resultados["rag_query"] = medir(
+            lambda i: requisitar("POST", "/api/rag/query", json={"question": questoes[i]}),
+            args.repeticoes, args.concorrencia, preparar=lambda _: limpar_tabela("rag_answer_cache")
+        )
+
+        print("/api/dashboard/progress...")
+        resultados["dashboard_progress"] = medir(lambda _: requisitar("GET", "/api/dashboard/progress"), args.repeticoes, args.concorrencia)
+
+        from metrics import resumo_etapas
+        saida = {
+            "executado_em": datetime.now().isoformat(),
+            "python": sys.version.split()[0],
+            "configuracao": vars(args),
+            "dados": {"dias_historico": dias, "linhas_progress": linhas, "respostas_livres": livres, "perguntas": len(perguntas)},
+            "chamadas_ollama": ollama_falso.chamadas,
+            "resultados": resultados,
+            "etapas": resumo_etapas(),
+        }
+    finally:
+        ollama_falso.shutdown()
+        os.chdir(DIRETORIO_BACKEND)
+        if not args.manter_diretorio:
+            shutil.rmtree(diretorio, ignore_errors=True)
+
+    print(f"\n{'benchmark':<20}{'req':>6}{'erros':>7}{'req/s':>9}{'p50 ms':>10}{'p95 ms':>10}")
+    for nome, r in resultados.items():
+        print(f"{nome:<20}{r['requisicoes']:>6}{r['erros']:>7}{r['vazao_por_s']:>9.2f}{r['latencia_p50_ms']:>10.1f}{r['latencia_p95_ms']:>10.1f}")
+
+    if args.comparar:
+        with open(args.comparar, "r", encoding="utf-8") as f:
+            comparar(saida, json.load(f))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(saida, f, indent=2, ensure_ascii=False)
+        print(f"\nResultados salvos em '{args.json}'.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+import sqlite3
+import hashlib
+import unicodedata
+from datetime import datetime, timedelta
+from database import conexao
+
+# --- CONFIGURAÇÕES ---
+# Número máximo de classificações mantidas em cache. Ao ultrapassar este limite,
+# as entradas usadas há mais tempo são removidas (LRU).
+CLASSIFICATION_CACHE_MAX_ENTRIES = 5000
+# O horário do último uso só é regravado se estiver mais velho que isto: uma reanálise toda em
+# cache não abre uma transação de escrita por resposta (concorrendo com as classificações antecipadas).
+CLASSIFICATION_CACHE_TOUCH_INTERVAL = timedelta(hours=1)
+
+def normalizar_resposta(texto):
+    """Normaliza o texto da resposta para que variações triviais ('Sim', ' sim. ') compartilhem a mesma entrada."""
+    texto = unicodedata.normalize('NFC', texto or '').strip().lower()
+    texto = " ".join(texto.split())
+    return texto.rstrip('.!')
+
+def hash_texto(texto):
+    return hashlib.sha256(texto.encode('utf-8')).hexdigest()
+
+def make_cache_key(question_id, answer_text, model_name, prompt_template):
+    """
+    Monta a chave do cache a partir do id da pergunta, da resposta normalizada,
+    do nome do modelo e de um hash do template de classificação. Qualquer mudança
+    no modelo ou no prompt invalida naturalmente as entradas antigas.
+    """
+    partes = [str(question_id), normalizar_resposta(answer_text), model_name, hash_texto(prompt_template)]
+    return hash_texto("\x1f".join(partes))
+
+def get_cached_classification(cache_key):
+    """Retorna o valor de 'pecado' (0 ou 1) armazenado para a chave, ou None se não houver."""
+    try:
+        with conexao() as conn:
+            row = conn.execute("SELECT is_sin, last_used_at FROM classification_cache WHERE cache_key = ?", (cache_key,)).fetchone()
+        if row is None:
+            return None
+        agora = datetime.now()
+        if datetime.fromisoformat(row[1]) < agora - CLASSIFICATION_CACHE_TOUCH_INTERVAL:
+            with conexao() as conn:
+                conn.execute("UPDATE classification_cache SET last_used_at = ? WHERE cache_key = ?", (agora.isoformat(), cache_key))
+        return row[0]
+    except sqlite3.Error as e:
+        print(f"Erro ao consultar o cache de classificação: {e}")
+        return None
+
+def store_classification(cache_key, question_id, is_sin):
+    """Grava (ou atualiza) uma classificação no cache e aplica a política de remoção."""
+    try:
+        now = datetime.now().isoformat()
+        with conexao() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "INSERT OR REPLACE INTO classification_cache (cache_key, question_id, is_sin, created_at, last_used_at) VALUES (?, ?, ?, ?, ?)",
+                (cache_key, question_id, is_sin, now, now)
+            )
+            cursor.execute(
+                """
+                DELETE FROM classification_cache WHERE cache_key IN (
+                    SELECT cache_key FROM classification_cache
+                    ORDER BY last_used_at DESC LIMIT -1 OFFSET ?
+                )
+                """,
+                (CLASSIFICATION_CACHE_MAX_ENTRIES,)
+            )
+    except sqlite3.Error as e:
+        print(f"Erro ao gravar no cache de classificação: {e}")
@@ -0,0 +1,65 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+from langchain.prompts import PromptTemplate
+from llm_classifier import (
+    CLASSIFICATION_PROMPT_TEMPLATE, preclassify_answer, get_classifier_llm, classify_item
+)
+
+# --- CONFIGURAÇÕES ---
+# Quantas respostas são classificadas ao mesmo tempo em segundo plano enquanto o usuário responde o exame.
+SPECULATIVE_MAX_WORKERS = 2
+
+# --- FILA DE CLASSIFICAÇÃO ESPECULATIVA ---
+# Cada resposta enviada é classificada assim que chega; o resultado vai para o cache
+# de classificação, de onde classify_exam o recupera no momento da análise.
+_executor = ThreadPoolExecutor(max_workers=SPECULATIVE_MAX_WORKERS, thread_name_prefix="classificador")
+_pendentes = set()
+_pendentes_lock = threading.Lock()
+_llm = None
+_prompt_template = None
+
+def _get_llm_and_prompt():
+    global _llm, _prompt_template
+    with _pendentes_lock:
+        if _llm is None:
+            _llm = get_classifier_llm()
+            _prompt_template = PromptTemplate.from_template(CLASSIFICATION_PROMPT_TEMPLATE)
+        return _llm, _prompt_template
+
+def _run(item):
+    llm, prompt_template = _get_llm_and_prompt()
+    return classify_item(llm, prompt_template, item)
+
+def _done(future):
+    with _pendentes_lock:
+        _pendentes.discard(future)
+
+def enqueue_answer(question_id, pergunta, answer_text):
+    """
+    Agenda a classificação de uma resposta recém-enviada.
+    Respostas vazias ou resolvidas por regra (sim/não) não ocupam a fila.
+    """
+    if not pergunta or not answer_text or not answer_text.strip():
+        return None
+    if preclassify_answer(answer_text, pergunta.get('polaridade')) is not None:
+        return None
+
+    future = _executor.submit(_run, (question_id, pergunta['texto'], answer_text))
+    with _pendentes_lock:
+        _pendentes.add(future)
+    future.add_done_callback(_done)
+    return future
+
+def wait_for_pending(timeout=None):
+    """Aguarda as classificações ainda em andamento. Retorna quantas estavam pendentes."""
+    with _pendentes_lock:
+        pendentes = list(_pendentes)
+    if pendentes:
+        print(f"Aguardando {len(pendentes)} classificações em segundo plano...")
+        wait(pendentes, timeout=timeout)
+    return len(pendentes)
+
+def encerrar(timeout=None):
+    """Aguarda as classificações pendentes e desliga a fila (usado no encerramento do servidor)."""
+    wait_for_pending(timeout=timeout)
+    _executor.shutdown(wait=False, cancel_futures=True)
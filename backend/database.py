@@ -1,33 +1,281 @@
+import queue
 import sqlite3
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
 
 # ANTES: DATABASE_NAME = 'backend/progress.db'
 # DEPOIS (CORRETO):
 DATABASE_NAME = 'progress.db'
 
+# Granularidades das agregações por categoria e o rótulo usado para perguntas fora do catálogo.
+ROLLUP_GRANULARIDADES = ("day", "week", "month")
+CATEGORIA_DESCONHECIDA = "Sem categoria"
+
+# Tabelas criadas por init_db (usadas também pela verificação de saúde do sistema).
+TABELAS = (
+    "progress", "daily_summary", "category_rollup", "analysis_jobs", "exam_sessions",
+    "exam_answers", "classification_cache", "rag_answer_cache"
+)
+
+# Conexões reaproveitadas entre requisições. Em modo WAL, leitores (dashboard, estado do exame)
+# não esperam o escritor (salvamento do progresso), e vice-versa.
+DB_POOL_SIZE = 8
+DB_BUSY_TIMEOUT = 5  # segundos aguardando o lock de escrita antes de desistir
+
+_pool = queue.LifoQueue(maxsize=DB_POOL_SIZE)
+
+def _nova_conexao():
+    conn = sqlite3.connect(DATABASE_NAME, timeout=DB_BUSY_TIMEOUT, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+@contextmanager
+def conexao():
+    """
+    Empresta uma conexão do pool. O bloco roda em uma transação: commit ao sair
+    normalmente, rollback se houver exceção. A conexão volta ao pool no final.
+    """
+    try:
+        conn = _pool.get_nowait()
+    except queue.Empty:
+        conn = _nova_conexao()
+    try:
+        with conn:
+            yield conn
+    finally:
+        conn.row_factory = None
+        try:
+            _pool.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+def fechar_conexoes():
+    """Fecha as conexões ociosas do pool (encerramento do servidor)."""
+    while True:
+        try:
+            _pool.get_nowait().close()
+        except queue.Empty:
+            return
+
 def init_db():
     """
-    Inicializa o banco de dados e cria a tabela 'progress' se ela não existir.
+    Inicializa o banco de dados e cria as tabelas do progresso e dos caches se elas não existirem.
+    Deve rodar uma vez na inicialização do processo, não a cada requisição.
     """
     try:
         # Agora ele vai criar/acessar o DB dentro da pasta 'backend', que é o correto
-        conn = sqlite3.connect(DATABASE_NAME)
-        cursor = conn.cursor()
-
-        # Cria a tabela para armazenar o resultado de cada pergunta
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS progress (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                exam_date TEXT NOT NULL,
-                question_id TEXT NOT NULL,
-                is_sin INTEGER NOT NULL CHECK(is_sin IN (0, 1))
-            )
-        ''')
-
-        conn.commit()
-        conn.close()
+        with conexao() as conn:
+            _criar_tabelas(conn.cursor())
         print(f"Banco de dados '{DATABASE_NAME}' inicializado com sucesso.")
     except Exception as e:
         print(f"Erro ao inicializar o banco de dados: {e}")
 
+def _criar_tabelas(cursor):
+    """Cria tabelas e índices (idempotente) e preenche o resumo diário na primeira execução."""
+    # Cria a tabela para armazenar o resultado de cada pergunta
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS progress (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            exam_date TEXT NOT NULL,
+            question_id TEXT NOT NULL,
+            is_sin INTEGER NOT NULL CHECK(is_sin IN (0, 1))
+        )
+    ''')
+
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_progress_exam_date ON progress (exam_date)')
+
+    # Resumo materializado por dia, mantido a cada gravação de exame (alimenta o dashboard).
+    # 'streak' é a quantidade de dias consecutivos com exame terminando neste dia.
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS daily_summary (
+            exam_date TEXT PRIMARY KEY,
+            sins INTEGER NOT NULL,
+            total INTEGER NOT NULL,
+            streak INTEGER NOT NULL,
+            updated_at TEXT NOT NULL
+        )
+    ''')
+    cursor.execute("SELECT COUNT(*) FROM daily_summary")
+    if cursor.fetchone()[0] == 0:
+        cursor.execute("SELECT DISTINCT exam_date FROM progress ORDER BY exam_date ASC")
+        datas = [row[0] for row in cursor.fetchall()]
+        if datas:
+            print(f"Montando o resumo diário a partir de {len(datas)} dias de histórico...")
+        for exam_date in datas:
+            atualizar_resumo_diario(cursor, exam_date, recalcular_seguintes=False)
+
+    # Agregações por categoria (mandamento), por dia, semana (segunda-feira) e mês (dia 1).
+    # Mantidas por atualizar_rollups_categoria a cada gravação de exame.
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS category_rollup (
+            granularity TEXT NOT NULL,
+            period_start TEXT NOT NULL,
+            categoria TEXT NOT NULL,
+            sins INTEGER NOT NULL,
+            total INTEGER NOT NULL,
+            PRIMARY KEY (granularity, period_start, categoria)
+        )
+    ''')
+
+    # Tarefas em segundo plano (ver job_manager.py)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS analysis_jobs (
+            id TEXT PRIMARY KEY,
+            kind TEXT NOT NULL,
+            status TEXT NOT NULL,
+            done INTEGER NOT NULL DEFAULT 0,
+            total INTEGER,
+            error TEXT,
+            created_at TEXT NOT NULL,
+            started_at TEXT,
+            finished_at TEXT,
+            owner_pid INTEGER
+        )
+    ''')
+    # Bancos criados antes da coluna 'owner_pid' (processo dono da tarefa) a recebem aqui
+    colunas = {row[1] for row in cursor.execute("PRAGMA table_info(analysis_jobs)")}
+    if "owner_pid" not in colunas:
+        cursor.execute("ALTER TABLE analysis_jobs ADD COLUMN owner_pid INTEGER")
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_analysis_jobs_status ON analysis_jobs (status)')
+
+    # Sessões de exame e suas respostas (uma linha por resposta, somente inserções)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS exam_sessions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            started_at TEXT NOT NULL,
+            exam_date TEXT NOT NULL,
+            closed_at TEXT
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS exam_answers (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            session_id INTEGER NOT NULL REFERENCES exam_sessions (id),
+            question_id TEXT NOT NULL,
+            answer TEXT NOT NULL,
+            answered_at TEXT NOT NULL
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_exam_answers_session ON exam_answers (session_id)')
+
+    # Cache das classificações do LLM, compartilhado entre a análise e o salvamento de progresso
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS classification_cache (
+            cache_key TEXT PRIMARY KEY,
+            question_id TEXT NOT NULL,
+            is_sin INTEGER NOT NULL CHECK(is_sin IN (0, 1)),
+            created_at TEXT NOT NULL,
+            last_used_at TEXT NOT NULL
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_classification_cache_last_used ON classification_cache (last_used_at)')
+
+    # Cache das respostas do assistente de doutrina (RAG), com o embedding da pergunta
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS rag_answer_cache (
+            question_hash TEXT PRIMARY KEY,
+            question TEXT NOT NULL,
+            embedding BLOB NOT NULL,
+            answer TEXT NOT NULL,
+            sources TEXT NOT NULL,
+            index_version TEXT NOT NULL,
+            created_at REAL NOT NULL,
+            last_used_at REAL NOT NULL
+        )
+    ''')
+
+def atualizar_resumo_diario(cursor, exam_date, recalcular_seguintes=True):
+    """
+    Recalcula a linha de 'daily_summary' de uma data a partir da tabela 'progress'.
+    A sequência de dias consecutivos vem do dia anterior, e os dias seguintes
+    já existentes são ajustados em cadeia.
+    """
+    cursor.execute("SELECT COALESCE(SUM(is_sin), 0), COUNT(*) FROM progress WHERE exam_date = ?", (exam_date,))
+    sins, total = cursor.fetchone()
+    if total == 0:
+        cursor.execute("DELETE FROM daily_summary WHERE exam_date = ?", (exam_date,))
+        streak = 0
+    else:
+        dia_anterior = (date.fromisoformat(exam_date) - timedelta(days=1)).isoformat()
+        cursor.execute("SELECT streak FROM daily_summary WHERE exam_date = ?", (dia_anterior,))
+        anterior = cursor.fetchone()
+        streak = (anterior[0] if anterior else 0) + 1
+        cursor.execute(
+            "INSERT OR REPLACE INTO daily_summary (exam_date, sins, total, streak, updated_at) VALUES (?, ?, ?, ?, ?)",
+            (exam_date, sins, total, streak, datetime.now().isoformat())
+        )
+
+    if recalcular_seguintes:
+        dia = date.fromisoformat(exam_date) + timedelta(days=1)
+        while True:
+            cursor.execute("SELECT 1 FROM daily_summary WHERE exam_date = ?", (dia.isoformat(),))
+            if cursor.fetchone() is None:
+                break
+            streak += 1
+            cursor.execute("UPDATE daily_summary SET streak = ?, updated_at = ? WHERE exam_date = ?", (streak, datetime.now().isoformat(), dia.isoformat()))
+            dia += timedelta(days=1)
+
+def inicio_do_periodo(exam_date, granularidade):
+    """Data (ISO) em que começa o dia, a semana (segunda-feira) ou o mês que contém 'exam_date'."""
+    dia = date.fromisoformat(exam_date)
+    if granularidade == "week":
+        dia -= timedelta(days=dia.weekday())
+    elif granularidade == "month":
+        dia = dia.replace(day=1)
+    return dia.isoformat()
+
+def fim_do_periodo(period_start, granularidade):
+    """Último dia (ISO) do período iniciado em 'period_start'."""
+    inicio = date.fromisoformat(period_start)
+    if granularidade == "week":
+        return (inicio + timedelta(days=6)).isoformat()
+    if granularidade == "month":
+        proximo_mes = (inicio.replace(day=28) + timedelta(days=4)).replace(day=1)
+        return (proximo_mes - timedelta(days=1)).isoformat()
+    return period_start
+
+def atualizar_rollups_categoria(cursor, exam_date, categorias):
+    """
+    Recalcula as agregações por categoria do dia 'exam_date' a partir de 'progress' e, em seguida,
+    a semana e o mês que contêm esse dia a partir das linhas diárias (sem varrer o histórico).
+    'categorias' mapeia question_id -> categoria.
+    """
+    cursor.execute("SELECT question_id, is_sin FROM progress WHERE exam_date = ?", (exam_date,))
+    por_categoria = {}
+    for question_id, is_sin in cursor.fetchall():
+        totais = por_categoria.setdefault(categorias.get(question_id, CATEGORIA_DESCONHECIDA), [0, 0])
+        totais[0] += is_sin
+        totais[1] += 1
+
+    cursor.execute("DELETE FROM category_rollup WHERE granularity = 'day' AND period_start = ?", (exam_date,))
+    cursor.executemany(
+        "INSERT INTO category_rollup (granularity, period_start, categoria, sins, total) VALUES ('day', ?, ?, ?, ?)",
+        [(exam_date, categoria, sins, total) for categoria, (sins, total) in por_categoria.items()]
+    )
+
+    for granularidade in ROLLUP_GRANULARIDADES[1:]:
+        inicio = inicio_do_periodo(exam_date, granularidade)
+        cursor.execute("DELETE FROM category_rollup WHERE granularity = ? AND period_start = ?", (granularidade, inicio))
+        cursor.execute('''
+            INSERT INTO category_rollup (granularity, period_start, categoria, sins, total)
+            SELECT ?, ?, categoria, SUM(sins), SUM(total) FROM category_rollup
+            WHERE granularity = 'day' AND period_start BETWEEN ? AND ?
+            GROUP BY categoria
+        ''', (granularidade, inicio, inicio, fim_do_periodo(inicio, granularidade)))
+
+def preencher_rollups_categoria(categorias):
+    """Gera as agregações por categoria do histórico existente, caso a tabela ainda esteja vazia."""
+    with conexao() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT 1 FROM category_rollup LIMIT 1")
+        if cursor.fetchone() is None:
+            cursor.execute("SELECT DISTINCT exam_date FROM progress ORDER BY exam_date ASC")
+            datas = [row[0] for row in cursor.fetchall()]
+            if datas:
+                print(f"Gerando as agregações por categoria de {len(datas)} dias de histórico...")
+            for exam_date in datas:
+                atualizar_rollups_categoria(cursor, exam_date, categorias)
+
 if __name__ == '__main__':
     init_db()
\ No newline at end of file
@@ -0,0 +1,69 @@
+import sqlite3
+from array import array
+from classification_cache import hash_texto
+
+# --- CONFIGURAÇÕES ---
+# Banco separado do progress.db: ele só é usado na construção do índice e pode ficar grande.
+EMBEDDING_CACHE_PATH = "embedding_cache.db"
+# Limite de parâmetros por consulta no SQLite
+_LOTE_CONSULTA = 500
+
+def _conectar():
+    conn = sqlite3.connect(EMBEDDING_CACHE_PATH)
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS embeddings (
+            model_name TEXT NOT NULL,
+            text_hash TEXT NOT NULL,
+            vector BLOB NOT NULL,
+            PRIMARY KEY (model_name, text_hash)
+        )
+    ''')
+    return conn
+
+def _buscar(conn, model_name, hashes):
+    encontrados = {}
+    for i in range(0, len(hashes), _LOTE_CONSULTA):
+        lote = hashes[i:i + _LOTE_CONSULTA]
+        marcadores = ",".join("?" * len(lote))
+        cursor = conn.execute(
+            f"SELECT text_hash, vector FROM embeddings WHERE model_name = ? AND text_hash IN ({marcadores})",
+            [model_name, *lote]
+        )
+        for text_hash, vector in cursor:
+            vetor = array('f')
+            vetor.frombytes(vector)
+            encontrados[text_hash] = vetor.tolist()
+    return encontrados
+
+def embed_documents_cached(embeddings, model_name, textos):
+    """
+    Gera os embeddings de 'textos', reaproveitando os vetores já calculados para o mesmo
+    modelo e o mesmo texto (pelo hash do conteúdo). Só os trechos inéditos vão ao modelo.
+    Retorna (vetores na ordem de 'textos', quantidade de trechos vindos do cache).
+    """
+    hashes = [hash_texto(texto) for texto in textos]
+    try:
+        conn = _conectar()
+    except sqlite3.Error as e:
+        print(f"Cache de embeddings indisponível, calculando tudo: {e}")
+        return embeddings.embed_documents(textos), 0
+
+    with conn:
+        encontrados = _buscar(conn, model_name, list(set(hashes)))
+        faltando = {}
+        for text_hash, texto in zip(hashes, textos):
+            if text_hash not in encontrados:
+                faltando.setdefault(text_hash, texto)
+
+        if faltando:
+            novos = embeddings.embed_documents(list(faltando.values()))
+            for text_hash, vetor in zip(faltando.keys(), novos):
+                encontrados[text_hash] = vetor
+            conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (model_name, text_hash, vector) VALUES (?, ?, ?)",
+                [(model_name, h, array('f', v).tobytes()) for h, v in zip(faltando.keys(), novos)]
+            )
+    conn.close()
+
+    acertos = sum(1 for text_hash in hashes if text_hash not in faltando)
+    return [encontrados[text_hash] for text_hash in hashes], acertos
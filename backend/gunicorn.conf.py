@@ -0,0 +1,28 @@
+# Configuração do gunicorn para servir o backend com vários processos (Linux/macOS):
+#
+#     gunicorn -c gunicorn.conf.py api_server:app
+#
+# Cada processo (worker) importa api_server por conta própria, então o banco, o pool de
+# conexões, o modelo e a cadeia de RAG são inicializados uma vez por worker (sem preload_app,
+# nada é compartilhado entre processos via fork). As tarefas em segundo plano, a fila de
+# classificações antecipadas e o limite de gerações simultâneas (INSPECTORUM_LLM_CONCURRENCY)
+# ficam na memória de cada worker; o progresso e os caches persistentes ficam no SQLite (modo WAL).
+# Por isso o padrão é um único worker com várias threads: com mais workers, o limite de gerações
+# vale por processo e o status de uma tarefa é acompanhado lendo o banco a cada segundo.
+import os
+
+os.environ.setdefault("INSPECTORUM_WARMUP", "1")
+
+bind = f"{os.environ.get('INSPECTORUM_HOST', '127.0.0.1')}:{os.environ.get('INSPECTORUM_PORT', '5000')}"
+workers = int(os.environ.get("INSPECTORUM_WORKERS", "1"))
+worker_class = "gthread"
+threads = int(os.environ.get("INSPECTORUM_THREADS", "8"))
+# Gerações em streaming podem levar dezenas de segundos
+timeout = 300
+graceful_timeout = int(os.environ.get("INSPECTORUM_SHUTDOWN_TIMEOUT", "30"))
+preload_app = False
+
+def worker_exit(server, worker):
+    """Encerramento gracioso de cada worker: termina as tarefas pendentes e fecha as conexões."""
+    from api_server import encerrar_recursos
+    encerrar_recursos(graceful_timeout)
@@ -0,0 +1,101 @@
+import os
+import threading
+import time
+from database import TABELAS, conexao
+from llm_clients import LLM_MODEL_NAME, OLLAMA_KEEP_ALIVE, OLLAMA_NUM_CTX, get_ollama_client
+
+# --- VERIFICAÇÃO DE SAÚDE DO SISTEMA ---
+# A verificação normal não gera texto: consulta a lista de modelos e os modelos carregados
+# no Ollama, os arquivos essenciais e o esquema do banco. O resultado fica em cache por
+# HEALTH_CACHE_TTL segundos. O modo profundo faz uma geração curta e cronometrada.
+
+HEALTH_CACHE_TTL = 15  # segundos
+DEEP_CHECK_NUM_PREDICT = 8  # tokens gerados na verificação profunda
+
+_cache = {"resultado": None, "expira_em": 0.0}
+_cache_lock = threading.Lock()
+
+def _nome_modelo(modelo):
+    return modelo.get('model') or modelo.get('name')
+
+def verificar_modelo():
+    """Confere se o modelo está instalado e se já está carregado na memória do Ollama (sem inferência)."""
+    client = get_ollama_client()
+    try:
+        instalados = {_nome_modelo(m) for m in client.list()['models']}
+    except Exception as e:
+        return {"ok": False, "error": f"Não foi possível conectar ao Ollama. O serviço está rodando? Erro: {e}"}
+    if LLM_MODEL_NAME not in instalados:
+        return {"ok": False, "error": f"Modelo LLM '{LLM_MODEL_NAME}' não encontrado no Ollama. Execute 'ollama pull {LLM_MODEL_NAME}'."}
+
+    info = {"ok": True, "model": LLM_MODEL_NAME, "loaded": False}
+    try:
+        for modelo in client.ps()['models']:
+            if _nome_modelo(modelo) == LLM_MODEL_NAME:
+                expira = modelo.get('expires_at')
+                info.update(loaded=True, size_vram=modelo.get('size_vram'), expires_at=str(expira) if expira else None)
+    except Exception as e:
+        # 'ps' é apenas informativo; versões antigas do Ollama não o oferecem
+        info["loaded_error"] = str(e)
+    return info
+
+def verificar_arquivos(arquivos):
+    faltando = [caminho for caminho in arquivos if not os.path.exists(caminho)]
+    if faltando:
+        return {"ok": False, "errors": [f"Arquivo essencial não encontrado: {caminho}" for caminho in faltando]}
+    return {"ok": True}
+
+def verificar_banco():
+    """Confere se todas as tabelas criadas por init_db existem."""
+    try:
+        with conexao() as conn:
+            existentes = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    except Exception as e:
+        return {"ok": False, "error": f"Não foi possível abrir o banco de dados: {e}"}
+    faltando = [tabela for tabela in TABELAS if tabela not in existentes]
+    if faltando:
+        return {"ok": False, "error": f"Tabelas ausentes no banco de dados: {', '.join(faltando)}."}
+    return {"ok": True}
+
+def verificar_geracao():
+    """Verificação profunda: gera poucos tokens e mede o tempo (carrega o modelo se necessário)."""
+    inicio = time.perf_counter()
+    try:
+        resposta = get_ollama_client().generate(
+            model=LLM_MODEL_NAME, prompt="teste", keep_alive=OLLAMA_KEEP_ALIVE,
+            options={"num_predict": DEEP_CHECK_NUM_PREDICT, "num_ctx": OLLAMA_NUM_CTX}
+        )
+    except Exception as e:
+        return {"ok": False, "error": f"Falha na geração de teste: {e}"}
+    return {
+        "ok": True,
+        "duration_s": round(time.perf_counter() - inicio, 3),
+        "load_duration_s": round((resposta.get('load_duration') or 0) / 1e9, 3),
+        "eval_count": resposta.get('eval_count'),
+    }
+
+def verificar_sistema(arquivos, deep=False):
+    """
+    Retorna o resultado da verificação: {"status": "ok"|"error", "errors": [...], "checks": {...}}.
+    A verificação rápida é reaproveitada por HEALTH_CACHE_TTL segundos; a profunda nunca vem do cache.
+    """
+    agora = time.monotonic()
+    if not deep:
+        with _cache_lock:
+            if _cache["resultado"] and agora < _cache["expira_em"]:
+                return dict(_cache["resultado"], cached=True)
+
+    checks = {"model": verificar_modelo(), "files": verificar_arquivos(arquivos), "database": verificar_banco()}
+    if deep:
+        checks["generation"] = verificar_geracao()
+
+    errors = []
+    for check in checks.values():
+        if not check["ok"]:
+            errors.extend(check.get("errors") or [check["error"]])
+    resultado = {"status": "ok" if not errors else "error", "errors": errors, "checks": checks, "checked_at": time.time()}
+
+    if not deep:
+        with _cache_lock:
+            _cache.update(resultado=resultado, expira_em=agora + HEALTH_CACHE_TTL)
+    return dict(resultado, cached=False)
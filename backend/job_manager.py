@@ -0,0 +1,189 @@
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime
+from database import conexao
+
+# --- GERENCIADOR DE TAREFAS EM SEGUNDO PLANO ---
+# Substitui o antigo arquivo analysis.lock: cada tarefa recebe um id, registra o progresso
+# por pergunta, a duração e o erro (se houver). O estado fica em memória para a espera
+# longa (long-poll) e é gravado na tabela 'analysis_jobs' para sobreviver a reinicializações.
+# Cada linha guarda o pid do processo dono da tarefa: com vários processos (gunicorn), um processo
+# novo só marca como falhas as tarefas de processos que já não existem.
+
+STATUS_ATIVOS = ("queued", "running")
+JOB_MAX_WAIT = 30  # segundos máximos que uma requisição de status fica aguardando mudanças
+JOBS_EM_MEMORIA = 50  # tarefas finalizadas mantidas em memória (as demais continuam no banco)
+JOB_POLL_INTERVAL = 1  # segundos entre leituras do banco ao aguardar tarefas de outro processo
+
+_jobs = {}
+_condicao = threading.Condition()
+
+def _persistir(job):
+    with conexao() as conn:
+        conn.execute(
+            """
+            INSERT OR REPLACE INTO analysis_jobs
+                (id, kind, status, done, total, error, created_at, started_at, finished_at, owner_pid)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            (job["id"], job["kind"], job["status"], job["done"], job["total"], job["error"],
+             job["created_at"], job["started_at"], job["finished_at"], os.getpid())
+        )
+
+def _descartar_antigos():
+    """Mantém em memória só as tarefas ativas e as finalizadas mais recentes."""
+    finalizados = [j for j in _jobs.values() if j["status"] not in STATUS_ATIVOS]
+    finalizados.sort(key=lambda j: j["created_at"])
+    for job in finalizados[:-JOBS_EM_MEMORIA]:
+        del _jobs[job["id"]]
+
+def _atualizar(job_id, persistir=True, **campos):
+    with _condicao:
+        job = _jobs[job_id]
+        job.update(campos)
+        job["version"] += 1
+        copia = dict(job)
+        _condicao.notify_all()
+    if persistir:
+        _persistir(copia)
+
+def _duracao(job):
+    if not job.get("started_at"):
+        return None
+    fim = datetime.fromisoformat(job["finished_at"]) if job.get("finished_at") else datetime.now()
+    return round((fim - datetime.fromisoformat(job["started_at"])).total_seconds(), 3)
+
+def _publico(job):
+    dados = {k: job[k] for k in ("id", "kind", "status", "done", "total", "error", "created_at", "started_at", "finished_at", "version")}
+    dados["duration_s"] = _duracao(job)
+    return dados
+
+def _processo_vivo(pid):
+    if not pid or pid == os.getpid():
+        return False
+    if os.name == "nt":
+        # No Windows o servidor roda em um único processo (waitress) e os.kill(pid, 0) encerraria o alvo
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+def recuperar_jobs_interrompidos():
+    """
+    Chamada na inicialização: tarefas que ficaram 'queued' ou 'running' e cujo processo dono não
+    existe mais são marcadas como falhas em vez de travar o status para sempre. Tarefas de outros
+    processos ainda vivos (outros workers do gunicorn) não são tocadas.
+    """
+    with conexao() as conn:
+        ativos = conn.execute(
+            "SELECT id, owner_pid FROM analysis_jobs WHERE status IN (?, ?)", STATUS_ATIVOS
+        ).fetchall()
+        interrompidos = [(job_id,) for job_id, pid in ativos if not _processo_vivo(pid)]
+        conn.executemany(
+            "UPDATE analysis_jobs SET status = 'failed', error = ?, finished_at = ? WHERE id = ?",
+            [("Interrompida pela reinicialização do servidor.", datetime.now().isoformat(), job_id) for (job_id,) in interrompidos]
+        )
+    if interrompidos:
+        print(f"{len(interrompidos)} tarefa(s) interrompida(s) marcada(s) como falha.")
+    return len(interrompidos)
+
+def iniciar_job(kind, alvo, *args, **kwargs):
+    """
+    Executa 'alvo(*args, ao_progredir=..., **kwargs)' em uma thread e retorna o id da tarefa.
+    'ao_progredir(feitas, total)' atualiza o progresso visível no endpoint de status.
+    Se 'alvo' retornar um texto, a tarefa termina 'succeeded' com esse aviso no campo 'error'
+    (ex.: progresso salvo sem algumas respostas).
+    """
+    job_id = uuid.uuid4().hex
+    job = {
+        "id": job_id, "kind": kind, "status": "queued", "done": 0, "total": None, "error": None,
+        "created_at": datetime.now().isoformat(), "started_at": None, "finished_at": None, "version": 0
+    }
+    with _condicao:
+        _descartar_antigos()
+        _jobs[job_id] = job
+    _persistir(job)
+
+    def ao_progredir(feitas, total):
+        # O progresso muda a cada pergunta: só notifica quem espera, sem gravar no banco
+        _atualizar(job_id, persistir=False, done=feitas, total=total)
+
+    def executar():
+        _atualizar(job_id, status="running", started_at=datetime.now().isoformat())
+        try:
+            aviso = alvo(*args, ao_progredir=ao_progredir, **kwargs)
+            _atualizar(job_id, status="succeeded", error=aviso if isinstance(aviso, str) else None,
+                       finished_at=datetime.now().isoformat())
+        except Exception as e:
+            print(f"Erro na tarefa {kind} ({job_id}): {e}")
+            _atualizar(job_id, status="failed", error=str(e), finished_at=datetime.now().isoformat())
+        print(f"Tarefa {kind} ({job_id}) finalizada em {obter_job(job_id)['duration_s']}s.")
+
+    threading.Thread(target=executar, name=f"job-{kind}", daemon=True).start()
+    return job_id
+
+def obter_job(job_id):
+    """Estado da tarefa (da memória ou, para tarefas antigas, do banco), ou None se não existir."""
+    with _condicao:
+        if job_id in _jobs:
+            return _publico(_jobs[job_id])
+    with conexao() as conn:
+        conn.row_factory = sqlite3.Row
+        row = conn.execute("SELECT * FROM analysis_jobs WHERE id = ?", (job_id,)).fetchone()
+    if row is None:
+        return None
+    return _publico(dict(row, version=0))
+
+def aguardar_job(job_id, versao_conhecida=-1, timeout=JOB_MAX_WAIT):
+    """
+    Espera longa: retorna assim que a tarefa tiver uma versão mais nova que 'versao_conhecida',
+    terminar, ou o tempo esgotar (nesse caso, devolve o estado atual).
+    Tarefas de outro processo não estão em memória: o banco é relido a cada JOB_POLL_INTERVAL
+    segundos até o status mudar, para que o cliente não repita a requisição sem pausa.
+    """
+    limite = time.monotonic() + min(timeout, JOB_MAX_WAIT)
+    with _condicao:
+        while job_id in _jobs:
+            job = _jobs[job_id]
+            if job["version"] > versao_conhecida or job["status"] not in STATUS_ATIVOS:
+                return _publico(job)
+            restante = limite - time.monotonic()
+            if restante <= 0:
+                return _publico(job)
+            _condicao.wait(restante)
+
+    estado = obter_job(job_id)
+    status_inicial = estado["status"] if estado else None
+    while estado and estado["status"] == status_inicial and status_inicial in STATUS_ATIVOS:
+        restante = limite - time.monotonic()
+        if restante <= 0:
+            break
+        time.sleep(min(JOB_POLL_INTERVAL, restante))
+        estado = obter_job(job_id)
+    return estado
+
+def job_ativo(kind=None):
+    """A tarefa em andamento mais recente (opcionalmente de um tipo), ou None."""
+    with _condicao:
+        ativos = [j for j in _jobs.values() if j["status"] in STATUS_ATIVOS and (kind is None or j["kind"] == kind)]
+        if not ativos:
+            return None
+        return _publico(max(ativos, key=lambda j: j["created_at"]))
+
+def aguardar_jobs_ativos(timeout=JOB_MAX_WAIT):
+    """Espera (até 'timeout' segundos) as tarefas em andamento terminarem. Retorna quantas ainda restam."""
+    limite = time.monotonic() + timeout
+    with _condicao:
+        while True:
+            ativos = [j for j in _jobs.values() if j["status"] in STATUS_ATIVOS]
+            restante = limite - time.monotonic()
+            if not ativos or restante <= 0:
+                return len(ativos)
+            _condicao.wait(restante)
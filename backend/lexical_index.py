@@ -0,0 +1,110 @@
+import re
+import math
+import sqlite3
+import unicodedata
+
+# --- CONFIGURAÇÕES ---
+# Índice invertido BM25 salvo ao lado do índice FAISS, para buscas por termos exatos
+# ("indulgência", "jejum eucarístico", números de cânones) que os embeddings tratam mal.
+LEXICAL_INDEX_FILE = "lexical.db"
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+STOPWORDS = {
+    "a", "o", "as", "os", "um", "uma", "uns", "umas", "de", "do", "da", "dos", "das", "em", "no", "na",
+    "nos", "nas", "por", "pelo", "pela", "pelos", "pelas", "para", "com", "sem", "e", "ou", "que", "se",
+    "ao", "aos", "à", "às", "é", "ser", "foi", "são", "como", "mais", "mas", "não", "nao", "sua", "seu",
+    "suas", "seus", "lhe", "me", "te", "nós", "vos", "eu", "ele", "ela", "eles", "elas", "isso", "isto",
+    "qual", "quais", "quando", "onde", "porque", "sobre", "entre", "também", "já", "muito", "pois",
+}
+
+def _sem_acentos(texto):
+    return "".join(c for c in unicodedata.normalize("NFKD", texto) if not unicodedata.combining(c))
+
+_STOPWORDS_NORMALIZADAS = {_sem_acentos(p) for p in STOPWORDS}
+
+def tokenizar(texto):
+    """Minúsculas, sem acentos e sem stopwords; números (ex.: cânones) são mantidos."""
+    termos = re.findall(r"\w+", _sem_acentos(texto.lower()))
+    return [t for t in termos if t not in _STOPWORDS_NORMALIZADAS and (len(t) > 1 or t.isdigit())]
+
+def abrir_indice_lexical(path):
+    conn = sqlite3.connect(path, check_same_thread=False)
+    conn.execute("CREATE TABLE IF NOT EXISTS docs (doc_id TEXT PRIMARY KEY, length INTEGER NOT NULL)")
+    conn.execute("CREATE TABLE IF NOT EXISTS postings (term TEXT NOT NULL, doc_id TEXT NOT NULL, tf INTEGER NOT NULL)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_postings_term ON postings (term)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_postings_doc ON postings (doc_id)")
+    return conn
+
+def abrir_indice_lexical_leitura(path):
+    """Conexão somente leitura para as consultas do servidor (aberta uma vez, sem criar tabelas)."""
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+    conn.execute("PRAGMA query_only = 1")
+    return conn
+
+def adicionar_documentos(conn, ids, textos):
+    """Indexa os trechos com os mesmos ids usados no docstore do FAISS."""
+    docs, postings = [], []
+    for doc_id, texto in zip(ids, textos):
+        termos = tokenizar(texto)
+        docs.append((doc_id, len(termos)))
+        frequencias = {}
+        for termo in termos:
+            frequencias[termo] = frequencias.get(termo, 0) + 1
+        postings.extend((termo, doc_id, tf) for termo, tf in frequencias.items())
+    with conn:
+        conn.executemany("INSERT OR REPLACE INTO docs (doc_id, length) VALUES (?, ?)", docs)
+        conn.executemany("INSERT INTO postings (term, doc_id, tf) VALUES (?, ?, ?)", postings)
+
+def remover_documentos(conn, ids):
+    with conn:
+        conn.executemany("DELETE FROM postings WHERE doc_id = ?", [(i,) for i in ids])
+        conn.executemany("DELETE FROM docs WHERE doc_id = ?", [(i,) for i in ids])
+
+def buscar(conn, consulta, k=10):
+    """
+    Retorna até 'k' pares (doc_id, pontuação BM25), do mais para o menos relevante.
+    O IDF de cada termo é calculado aqui (o SQLite nem sempre tem log); a soma das
+    pontuações, a ordenação e o LIMIT ficam no SQL, sem trazer todas as ocorrências para o Python.
+    """
+    termos = sorted(set(tokenizar(consulta)))
+    if not termos:
+        return []
+    total_docs, media_tamanho = conn.execute("SELECT COUNT(*), AVG(length) FROM docs").fetchone()
+    if not total_docs:
+        return []
+
+    marcadores = ", ".join("?" * len(termos))
+    frequencias = conn.execute(
+        f"SELECT term, COUNT(*) FROM postings WHERE term IN ({marcadores}) GROUP BY term", termos
+    ).fetchall()
+    if not frequencias:
+        return []
+
+    idfs = [(termo, math.log(1 + (total_docs - df + 0.5) / (df + 0.5))) for termo, df in frequencias]
+    valores = ", ".join("(?, ?)" for _ in idfs)
+    return conn.execute(
+        f"""
+        WITH termos(term, idf) AS (VALUES {valores})
+        SELECT p.doc_id,
+               SUM(t.idf * p.tf * (? + 1) / (p.tf + ? * (1 - ? + ? * d.length / ?))) AS pontuacao
+        FROM termos t
+        JOIN postings p ON p.term = t.term
+        JOIN docs d ON d.doc_id = p.doc_id
+        GROUP BY p.doc_id
+        ORDER BY pontuacao DESC
+        LIMIT ?
+        """,
+        [v for par in idfs for v in par] + [BM25_K1, BM25_K1, BM25_B, BM25_B, media_tamanho, k]
+    ).fetchall()
+
+def fundir_por_rrf(listas, k=60):
+    """
+    Reciprocal Rank Fusion: combina várias listas ordenadas de chaves somando 1/(k + posição).
+    Retorna as chaves na nova ordem.
+    """
+    pontuacoes = {}
+    for lista in listas:
+        for posicao, chave in enumerate(lista):
+            pontuacoes[chave] = pontuacoes.get(chave, 0.0) + 1.0 / (k + posicao + 1)
+    return sorted(pontuacoes, key=pontuacoes.get, reverse=True)
@@ -1,12 +1,19 @@
-import sqlite3
-import yaml
 import json
 from datetime import date
-from langchain_ollama import OllamaLLM
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from langchain.prompts import PromptTemplate
-from database import init_db, DATABASE_NAME
+from llm_clients import LLM_MODEL_NAME, get_llm
+from metrics import cronometrar
+from database import conexao, atualizar_resumo_diario, atualizar_rollups_categoria
+from session_store import carregar_respostas
+from classification_cache import normalizar_resposta, make_cache_key, get_cached_classification, store_classification
 
-LLM_MODEL_NAME = "phi3:3.8b-mini-4k-instruct-q4_0"
+# Número máximo de classificações enviadas ao Ollama ao mesmo tempo.
+# Para que o servidor de fato processe em paralelo, configure OLLAMA_NUM_PARALLEL com um valor equivalente.
+CLASSIFICATION_MAX_WORKERS = 4
+# Quantidade máxima de respostas da mesma categoria enviadas em um único prompt.
+# Com 1, cada resposta é classificada isoladamente com CLASSIFICATION_PROMPT_TEMPLATE.
+CLASSIFICATION_BATCH_SIZE = 8
 
 # =================================================================
 # CORREÇÃO APLICADA AQUI: AS CHAVES {} NOS EXEMPLOS FORAM DUPLICADAS
@@ -43,67 +50,289 @@ Resposta: {answer}
 Sua saída:
 """
 
-def analyze_and_store_exam(respostas_path='respostas.yaml', perguntas_path='perguntas.yaml'):
+BATCH_CLASSIFICATION_PROMPT_TEMPLATE = """
+Você é um teólogo moral e um especialista em análise de texto. Sua tarefa é analisar vários pares de pergunta e resposta de um exame de consciência.
+Para cada par, com base na resposta do usuário NO CONTEXTO da pergunta, determine se a resposta indica a ocorrência de um pecado.
+
+**Definição de Pecado:** Para esta tarefa, considere que a resposta indica um pecado se o usuário admitir uma falha, omissão ou ação deliberada que vai contra o ensinamento da pergunta. A resposta deve ser uma admissão clara de culpa ou falha.
+
+**REGRAS IMPORTANTES:**
+1.  Responda APENAS com um objeto JSON. Não inclua nenhuma outra palavra ou explicação.
+2.  O JSON deve ter uma chave para CADA id informado, exatamente como escrito.
+3.  O valor de cada chave deve ser 1 se a resposta indicar um pecado, ou 0 se não indicar.
+
+**Exemplo:**
+---
+[A1] Pergunta: "Eu neguei ou abandonei a minha fé?"
+Resposta: "Sim"
+
+[A2] Pergunta: "Tenho a preocupação de conhecê-la melhor?"
+Resposta: "Sim"
+
+[A3] Pergunta: "Fui honesto e diligente no meu trabalho?"
+Resposta: "Não"
+---
+Sua saída: {{"A1": 1, "A2": 0, "A3": 1}}
+
+Agora, analise os seguintes pares:
+---
+{itens}
+---
+Sua saída:
+"""
+
+# Respostas curtas que podem ser interpretadas sem o LLM (comparadas após normalizar_resposta).
+RESPOSTAS_AFIRMATIVAS = {"sim", "s"}
+RESPOSTAS_NEGATIVAS = {"não", "nao", "n"}
+
+def preclassify_answer(answer_text, polaridade):
+    """
+    Classificação determinística para respostas de sim/não, usando a 'polaridade' da pergunta.
+    Retorna 1 ou 0 quando a resposta é inequívoca, ou None quando ela precisa ir para o LLM.
+    """
+    if polaridade not in ('direta', 'inversa'):
+        return None
+
+    resposta = normalizar_resposta(answer_text)
+    if resposta in RESPOSTAS_AFIRMATIVAS:
+        afirmou = True
+    elif resposta in RESPOSTAS_NEGATIVAS:
+        afirmou = False
+    else:
+        return None
+
+    if polaridade == 'direta':
+        return 1 if afirmou else 0
+    return 0 if afirmou else 1
+
+def get_classifier_llm():
+    """Retorna o LLM configurado para a classificação (saída JSON, baixa temperatura), compartilhado pelo processo."""
+    return get_llm("classifier")
+
+def _cached_classification(question_id, answer_text):
+    """Procura a resposta no cache, aceitando resultados gerados tanto pelo prompt individual quanto pelo em lote."""
+    for template in (CLASSIFICATION_PROMPT_TEMPLATE, BATCH_CLASSIFICATION_PROMPT_TEMPLATE):
+        cached = get_cached_classification(make_cache_key(question_id, answer_text, LLM_MODEL_NAME, template))
+        if cached is not None:
+            return cached
+    return None
+
+def classify_answer(llm, prompt_template, question_id, question_text, answer_text):
     """
-    Lê um exame, usa o LLM para classificar cada resposta e salva no SQLite.
+    Classifica uma única resposta, consultando antes o cache persistente.
+    Retorna 1 (pecado), 0 (não pecado) ou None se o LLM não produzir uma saída válida.
     """
-    init_db()
+    cached = _cached_classification(question_id, answer_text)
+    if cached is not None:
+        return cached
+
+    prompt = prompt_template.format(question=question_text, answer=answer_text)
+    llm_output_str = llm.invoke(prompt)
+    llm_output = json.loads(llm_output_str) if isinstance(llm_output_str, str) else llm_output_str
+    is_sin = llm_output.get('pecado')
+    if is_sin not in (0, 1):
+        return None
 
+    cache_key = make_cache_key(question_id, answer_text, LLM_MODEL_NAME, CLASSIFICATION_PROMPT_TEMPLATE)
+    store_classification(cache_key, question_id, is_sin)
+    return is_sin
+
+def classify_item(llm, prompt_template, item):
+    """Classifica um item isolando a falha: um erro vira None e não interrompe os demais."""
+    question_id, question_text, answer_text = item[:3]
     try:
-        with open(perguntas_path, 'r', encoding='utf-8') as f:
-            perguntas_data = {p['id']: p['texto'] for p in yaml.safe_load(f)['perguntas']}
-    except FileNotFoundError:
-        print(f"ERRO CRÍTICO: O arquivo de perguntas '{perguntas_path}' não foi encontrado.")
-        return
-    
+        is_sin = classify_answer(llm, prompt_template, question_id, question_text, answer_text)
+        if is_sin is None:
+            print(f"  - Pergunta {question_id}: LLM não retornou a chave 'pecado'.")
+        return is_sin
+    except (json.JSONDecodeError, Exception) as e:
+        print(f"Erro ao classificar a pergunta {question_id}: {e}")
+        return None
+
+def _classify_batch(llm, prompt_template, batch_template, batch):
+    """
+    Classifica um lote de respostas com um único prompt que devolve {id: pecado}.
+    Se a saída vier malformada ou faltar algum id, esses itens são refeitos individualmente.
+    Retorna uma lista de resultados (1, 0 ou None) na mesma ordem do lote.
+    """
+    if len(batch) == 1:
+        return [classify_item(llm, prompt_template, batch[0])]
+
+    itens_texto = "\n\n".join(
+        f'[{question_id}] Pergunta: "{question_text}"\nResposta: "{answer_text}"'
+        for question_id, question_text, answer_text, _ in batch
+    )
     try:
-        with open(respostas_path, 'r', encoding='utf-8') as f:
-            respostas_data = yaml.safe_load(f)['respostas']
-    except FileNotFoundError:
-        print(f"AVISO: O arquivo de respostas '{respostas_path}' não foi encontrado. Nenhuma análise de progresso será feita.")
-        return
+        llm_output_str = llm.invoke(batch_template.format(itens=itens_texto))
+        llm_output = json.loads(llm_output_str) if isinstance(llm_output_str, str) else llm_output_str
+        if not isinstance(llm_output, dict):
+            llm_output = {}
+    except (json.JSONDecodeError, Exception) as e:
+        print(f"Erro na classificação em lote ({len(batch)} respostas), usando chamadas individuais: {e}")
+        llm_output = {}
 
-    llm = OllamaLLM(model=LLM_MODEL_NAME, format='json')
-    prompt_template = PromptTemplate.from_template(CLASSIFICATION_PROMPT_TEMPLATE)
-    
-    conn = sqlite3.connect(DATABASE_NAME)
-    cursor = conn.cursor()
+    resultados = []
+    for item in batch:
+        question_id, _, answer_text, _ = item
+        is_sin = llm_output.get(question_id)
+        if isinstance(is_sin, dict):
+            is_sin = is_sin.get('pecado')
+        if is_sin in (0, 1):
+            cache_key = make_cache_key(question_id, answer_text, LLM_MODEL_NAME, BATCH_CLASSIFICATION_PROMPT_TEMPLATE)
+            store_classification(cache_key, question_id, is_sin)
+            resultados.append(is_sin)
+        else:
+            resultados.append(classify_item(llm, prompt_template, item))
+    return resultados
 
-    today_str = date.today().isoformat()
+def _make_batches(itens, batch_size):
+    """Agrupa os itens por categoria, respeitando o tamanho máximo do lote e a ordem original."""
+    if batch_size <= 1:
+        return [[item] for item in itens]
 
-    # ===== ADICIONADO: Apaga os registros antigos do mesmo dia =====
-    print(f"Limpando registros existentes para a data: {today_str}...")
-    cursor.execute("DELETE FROM progress WHERE exam_date = ?", (today_str,))
-    # ==========================================================
+    por_categoria = {}
+    for item in itens:
+        por_categoria.setdefault(item[3], []).append(item)
 
-    print("Iniciando classificação das respostas com o LLM...")
+    batches = []
+    for grupo in por_categoria.values():
+        for i in range(0, len(grupo), batch_size):
+            batches.append(grupo[i:i + batch_size])
+    return batches
+
+def respostas_classificaveis(respostas_data, perguntas_data):
+    """(id, pergunta, resposta) das respostas que serão classificadas: pergunta conhecida e resposta não vazia."""
     for resp in respostas_data:
         question_id = resp['id_pergunta']
-        question_text = perguntas_data.get(question_id, "")
-        answer_text = resp['resposta']
+        pergunta = perguntas_data.get(question_id, {})
+        if pergunta.get('texto') and resp['resposta'].strip():
+            yield question_id, pergunta, resp['resposta']
+
+def classify_exam(respostas_data, perguntas_data, max_workers=CLASSIFICATION_MAX_WORKERS, batch_size=CLASSIFICATION_BATCH_SIZE, ao_classificar=None):
+    """
+    Classifica todas as respostas de um exame.
+    'perguntas_data' mapeia o id da pergunta para o seu registro em perguntas.yaml.
+    Respostas de sim/não são resolvidas por preclassify_answer e as já vistas vêm do cache;
+    apenas as demais vão ao LLM, agrupadas por categoria em lotes de até 'batch_size'.
+    Os lotes são enviados em paralelo (até 'max_workers' simultâneos).
+    'ao_classificar(feitas, total)', se informado, é chamado a cada resposta resolvida.
+    Retorna um dicionário {id_pergunta: pecado}; respostas vazias ou com erro ficam de fora.
+    """
+    classificaveis = list(respostas_classificaveis(respostas_data, perguntas_data))
+    total, feitas = len(classificaveis), 0
+    if ao_classificar:
+        ao_classificar(0, total)
+    classificacoes, itens = {}, []
+    regra = cache = 0
+    for question_id, pergunta, answer_text in classificaveis:
+        question_text = pergunta['texto']
+        is_sin = preclassify_answer(answer_text, pergunta.get('polaridade'))
+        if is_sin is not None:
+            regra += 1
+        else:
+            is_sin = _cached_classification(question_id, answer_text)
+            if is_sin is not None:
+                cache += 1
 
-        if not question_text or not answer_text.strip():
-            continue
+        if is_sin is not None:
+            classificacoes[question_id] = is_sin
+            feitas += 1
+            if ao_classificar:
+                ao_classificar(feitas, total)
+        else:
+            itens.append((question_id, question_text, answer_text, pergunta.get('categoria', "")))
 
-        prompt = prompt_template.format(question=question_text, answer=answer_text)
-        
-        try:
-            llm_output_str = llm.invoke(prompt)
-            llm_output = json.loads(llm_output_str) if isinstance(llm_output_str, str) else llm_output_str
-            is_sin = llm_output.get('pecado')
+    print(f"Classificação: {regra} por regra, {cache} do cache, {len(itens)} enviadas ao LLM.")
+    if not itens:
+        return classificacoes
 
-            if is_sin is not None:
-                print(f"  - Pergunta {question_id}: Pecado? {'Sim' if is_sin == 1 else 'Não'}")
-                cursor.execute(
-                    "INSERT INTO progress (exam_date, question_id, is_sin) VALUES (?, ?, ?)",
-                    (today_str, question_id, is_sin)
-                )
-            else:
-                print(f"  - Pergunta {question_id}: LLM não retornou a chave 'pecado'.")
-
-        except (json.JSONDecodeError, Exception) as e:
-            print(f"Erro ao processar a pergunta {question_id}: {e}")
-
-    conn.commit()
-    conn.close()
-    print("Análise de progresso salva no banco de dados.")
\ No newline at end of file
+    llm = get_classifier_llm()
+    prompt_template = PromptTemplate.from_template(CLASSIFICATION_PROMPT_TEMPLATE)
+    batch_template = PromptTemplate.from_template(BATCH_CLASSIFICATION_PROMPT_TEMPLATE)
+    batches = _make_batches(itens, batch_size)
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(batches)))) as executor:
+        futuros = {executor.submit(_classify_batch, llm, prompt_template, batch_template, batch): batch for batch in batches}
+        for futuro in as_completed(futuros):
+            batch = futuros[futuro]
+            for (question_id, _, _, _), is_sin in zip(batch, futuro.result()):
+                if is_sin is not None:
+                    classificacoes[question_id] = is_sin
+            feitas += len(batch)
+            if ao_classificar:
+                ao_classificar(feitas, total)
+
+    return classificacoes
+
+def analyze_and_store_exam(perguntas_data, classificacoes=None, session_id=None, ao_progredir=None):
+    """
+    Lê um exame (por padrão, a sessão aberta), usa o LLM para classificar cada resposta e salva no SQLite.
+    'perguntas_data' mapeia o id da pergunta para o seu registro (o catálogo já carregado pelo servidor).
+    Se 'classificacoes' for informado (resultado de classify_exam), o LLM não é chamado novamente.
+    'ao_progredir(feitas, total)', se informado, é chamado a cada resposta classificada ou, quando as
+    classificações já vieram prontas, a cada resposta gravada.
+    Respostas que ficarem sem classificação são tentadas mais uma vez; as que falharem de novo ficam
+    de fora e as demais são gravadas normalmente. Nesse caso, a função retorna um aviso com os ids
+    (registrado no campo 'error' da tarefa). Exame sem respostas ou nenhuma resposta classificada
+    são levantados como exceção (tarefa 'failed').
+    O esquema do banco deve ter sido criado por init_db na inicialização do processo.
+    """
+    respostas_data = carregar_respostas(session_id)
+    classificaveis = [question_id for question_id, _, _ in respostas_classificaveis(respostas_data, perguntas_data)]
+    if not classificaveis:
+        raise ValueError("Nenhuma resposta encontrada para o exame. Nenhuma análise de progresso foi feita.")
+
+    gravar_com_progresso = classificacoes is not None
+    if classificacoes is None:
+        print("Iniciando classificação das respostas com o LLM...")
+        with cronometrar("store_progress", "classification"):
+            classificacoes = classify_exam(respostas_data, perguntas_data, ao_classificar=ao_progredir)
+    else:
+        print("Reutilizando as classificações já calculadas pela análise principal.")
+
+    # Falhas isoladas: só as respostas sem classificação voltam ao LLM (as demais já estão no cache)
+    faltando = [question_id for question_id in classificaveis if question_id not in classificacoes]
+    if faltando:
+        print(f"{len(faltando)} resposta(s) sem classificação. Tentando novamente...")
+        respostas_faltando = [resp for resp in respostas_data if resp['id_pergunta'] in set(faltando)]
+        with cronometrar("store_progress", "classification"):
+            classificacoes = {**classificacoes, **classify_exam(respostas_faltando, perguntas_data)}
+        faltando = [question_id for question_id in classificaveis if question_id not in classificacoes]
+    if not classificacoes:
+        raise RuntimeError("Nenhuma resposta pôde ser classificada. O progresso do dia não foi alterado.")
+
+    # Tudo é calculado antes de abrir a transação, que fica curta: um DELETE, um executemany
+    # e a atualização das agregações, sem nenhuma chamada ao LLM no meio.
+    today_str = date.today().isoformat()
+    linhas = []
+    for question_id, is_sin in classificacoes.items():
+        print(f"  - Pergunta {question_id}: Pecado? {'Sim' if is_sin == 1 else 'Não'}")
+        linhas.append((today_str, question_id, is_sin))
+    categorias = {qid: p.get('categoria', "") for qid, p in perguntas_data.items()}
+    gravar_com_progresso = gravar_com_progresso and ao_progredir is not None
+    if gravar_com_progresso:
+        ao_progredir(0, len(linhas))
+
+    with cronometrar("store_progress", "write"), conexao() as conn:
+        cursor = conn.cursor()
+        # ===== ADICIONADO: Apaga os registros antigos do mesmo dia =====
+        print(f"Limpando registros existentes para a data: {today_str}...")
+        cursor.execute("DELETE FROM progress WHERE exam_date = ?", (today_str,))
+        # ==========================================================
+        if gravar_com_progresso:
+            # O progresso só notifica quem aguarda a tarefa (em memória); a transação continua única
+            for feitas, linha in enumerate(linhas, 1):
+                cursor.execute("INSERT INTO progress (exam_date, question_id, is_sin) VALUES (?, ?, ?)", linha)
+                ao_progredir(feitas, len(linhas))
+        else:
+            cursor.executemany("INSERT INTO progress (exam_date, question_id, is_sin) VALUES (?, ?, ?)", linhas)
+        atualizar_resumo_diario(cursor, today_str)
+        atualizar_rollups_categoria(cursor, today_str, categorias)
+
+    print("Análise de progresso salva no banco de dados.")
+    if faltando:
+        aviso = (f"Progresso salvo sem {len(faltando)} resposta(s) que não puderam ser classificadas "
+                 f"(perguntas {', '.join(map(str, faltando))}).")
+        print(f"AVISO: {aviso}")
+        return aviso
+    return None
@@ -0,0 +1,86 @@
+import os
+import threading
+import httpx
+import ollama
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_ollama import OllamaLLM
+from metrics import registrar_chamada_ollama
+
+# --- CONFIGURAÇÕES ---
+# Único lugar onde o modelo e o endereço do Ollama são definidos; os demais módulos importam daqui.
+LLM_MODEL_NAME = "phi3:3.8b-mini-4k-instruct-q4_0"
+OLLAMA_HOST = os.environ.get("OLLAMA_HOST", "http://localhost:11434")
+def _keep_alive(valor):
+    """
+    Durações com unidade ("30m", "24h") seguem como texto. Números puros viram inteiros (segundos;
+    -1 = indefinidamente), pois o Ollama interpreta textos como durações do Go e rejeita "-1" sem unidade.
+    """
+    try:
+        return int(valor)
+    except ValueError:
+        return valor
+
+# Por quanto tempo o Ollama mantém o modelo na memória após cada chamada (-1 = indefinidamente).
+OLLAMA_KEEP_ALIVE = _keep_alive(os.environ.get("INSPECTORUM_OLLAMA_KEEP_ALIVE", "30m"))
+# Conexões HTTP mantidas abertas com o Ollama, compartilhadas por todos os papéis.
+OLLAMA_MAX_CONNECTIONS = 8
+
+# Tamanho do contexto de TODAS as chamadas ao modelo (papéis, aquecimento e verificação de saúde).
+# O Ollama recarrega o modelo quando 'num_ctx' muda entre chamadas, então ele precisa ser o mesmo
+# em todas; 4096 é o contexto completo do phi3-mini.
+OLLAMA_NUM_CTX = 4096
+
+# Opções de cada papel. 'num_predict' limita o tamanho da saída conforme o uso.
+LLM_ROLES = {
+    # Classificação de respostas: JSON curto ({"pecado": 0/1} ou um objeto por lote)
+    "classifier": {"format": "json", "temperature": 0.1, "num_predict": 256, "num_ctx": OLLAMA_NUM_CTX},
+    # Reflexão textual sobre o exame
+    "analyzer": {"num_predict": 1024, "num_ctx": OLLAMA_NUM_CTX, "stop": ["###", "Instruction:"]},
+    # Respostas do assistente de doutrina, com o contexto recuperado no prompt
+    "rag": {"temperature": 0.1, "num_predict": 768, "num_ctx": OLLAMA_NUM_CTX},
+}
+
+class ColetorOllama(BaseCallbackHandler):
+    """Repassa para as métricas as contagens e durações que o Ollama devolve ao final de cada geração."""
+
+    def __init__(self, papel):
+        self.papel = papel
+
+    def on_llm_end(self, response, **kwargs):
+        for geracoes in response.generations:
+            for geracao in geracoes:
+                registrar_chamada_ollama(self.papel, geracao.generation_info)
+
+# --- REGISTRO DE CLIENTES ---
+# Os clientes são criados uma vez por processo e reutilizados por todas as requisições.
+# Todos usam o mesmo transporte HTTP, ou seja, o mesmo pool de conexões com o Ollama.
+_transporte = httpx.HTTPTransport(limits=httpx.Limits(
+    max_connections=OLLAMA_MAX_CONNECTIONS, max_keepalive_connections=OLLAMA_MAX_CONNECTIONS
+))
+_clientes = {}
+_ollama_client = None
+_lock = threading.Lock()
+
+def get_ollama_client():
+    """Cliente da biblioteca 'ollama' (listar modelos, pré-carregar etc.) sobre o pool compartilhado."""
+    global _ollama_client
+    with _lock:
+        if _ollama_client is None:
+            _ollama_client = ollama.Client(host=OLLAMA_HOST, transport=_transporte)
+        return _ollama_client
+
+def get_llm(role):
+    """Retorna o OllamaLLM configurado para o papel ('classifier', 'analyzer' ou 'rag')."""
+    if role not in LLM_ROLES:
+        raise ValueError(f"Papel de LLM desconhecido: '{role}'. Use um de: {', '.join(LLM_ROLES)}.")
+    with _lock:
+        if role not in _clientes:
+            _clientes[role] = OllamaLLM(
+                model=LLM_MODEL_NAME,
+                base_url=OLLAMA_HOST,
+                keep_alive=OLLAMA_KEEP_ALIVE,
+                client_kwargs={"transport": _transporte},
+                callbacks=[ColetorOllama(role)],
+                **LLM_ROLES[role]
+            )
+        return _clientes[role]
@@ -0,0 +1,114 @@
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+# --- MÉTRICAS (formato de texto do Prometheus) ---
+# Histogramas de latência por operação/etapa e contadores simples, mantidos em memória
+# e expostos em /api/metrics. Cada processo do servidor tem os seus próprios valores.
+
+# Limites (em segundos) dos histogramas de latência: de milissegundos (busca no índice)
+# a minutos (geração longa em CPU).
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+_DESCRICOES = {
+    "inspectorum_stage_duration_seconds": ("histogram", "Duração de cada etapa das operações (rag_query, analyze_exam, store_progress, build_index)."),
+    "inspectorum_ollama_duration_seconds": ("histogram", "Durações reportadas pelo Ollama por chamada (total, load, prompt_eval, eval)."),
+    "inspectorum_ollama_prompt_tokens_total": ("counter", "Tokens de prompt avaliados pelo Ollama (prompt_eval_count)."),
+    "inspectorum_ollama_generated_tokens_total": ("counter", "Tokens gerados pelo Ollama (eval_count)."),
+    "inspectorum_ollama_calls_total": ("counter", "Chamadas ao Ollama por papel do LLM."),
+    "inspectorum_rag_cache_total": ("counter", "Consultas ao cache de respostas do RAG por resultado (exact, similar, miss)."),
+}
+
+_histogramas = {}
+_contadores = {}
+_lock = threading.Lock()
+
+def _chave(nome, labels):
+    return nome, tuple(sorted(labels.items()))
+
+def observar(nome, valor, **labels):
+    """Registra um valor (em segundos) no histograma 'nome' com os rótulos informados."""
+    with _lock:
+        dados = _histogramas.setdefault(_chave(nome, labels), [[0] * len(LATENCY_BUCKETS), 0.0, 0])
+        posicao = bisect_left(LATENCY_BUCKETS, valor)
+        if posicao < len(LATENCY_BUCKETS):
+            dados[0][posicao] += 1
+        dados[1] += valor
+        dados[2] += 1
+
+def incrementar(nome, valor=1, **labels):
+    with _lock:
+        chave = _chave(nome, labels)
+        _contadores[chave] = _contadores.get(chave, 0) + valor
+
+@contextmanager
+def cronometrar(operacao, etapa):
+    """Mede o bloco e registra em inspectorum_stage_duration_seconds{operation, stage} (mesmo se houver erro)."""
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        observar("inspectorum_stage_duration_seconds", time.perf_counter() - inicio, operation=operacao, stage=etapa)
+
+def registrar_chamada_ollama(papel, info):
+    """
+    Registra os campos que o Ollama devolve ao final de cada geração
+    (durações em nanossegundos e contagens de tokens).
+    """
+    if not info or ("eval_count" not in info and "total_duration" not in info):
+        return
+    incrementar("inspectorum_ollama_calls_total", role=papel)
+    incrementar("inspectorum_ollama_prompt_tokens_total", info.get("prompt_eval_count") or 0, role=papel)
+    incrementar("inspectorum_ollama_generated_tokens_total", info.get("eval_count") or 0, role=papel)
+    for fase in ("total", "load", "prompt_eval", "eval"):
+        duracao = info.get(f"{fase}_duration")
+        if duracao:
+            observar("inspectorum_ollama_duration_seconds", duracao / 1e9, role=papel, phase=fase)
+
+def _formatar_labels(labels, extra=()):
+    pares = list(labels) + list(extra)
+    if not pares:
+        return ""
+    return "{" + ",".join(f'{k}="{str(v)}"' for k, v in pares) + "}"
+
+def _numero(valor):
+    return repr(float(valor)) if isinstance(valor, float) else str(valor)
+
+def exportar():
+    """Todas as métricas no formato de texto do Prometheus (versão 0.0.4)."""
+    with _lock:
+        histogramas = {k: (list(v[0]), v[1], v[2]) for k, v in _histogramas.items()}
+        contadores = dict(_contadores)
+
+    linhas = []
+    for nome, (tipo, descricao) in _DESCRICOES.items():
+        linhas.append(f"# HELP {nome} {descricao}")
+        linhas.append(f"# TYPE {nome} {tipo}")
+        if tipo == "histogram":
+            for (chave_nome, labels), (buckets, soma, total) in sorted(histogramas.items()):
+                if chave_nome != nome:
+                    continue
+                acumulado = 0
+                for limite, quantidade in zip(LATENCY_BUCKETS, buckets):
+                    acumulado += quantidade
+                    linhas.append(f"{nome}_bucket{_formatar_labels(labels, [('le', _numero(float(limite)))])} {acumulado}")
+                linhas.append(f"{nome}_bucket{_formatar_labels(labels, [('le', '+Inf')])} {total}")
+                linhas.append(f"{nome}_sum{_formatar_labels(labels)} {_numero(soma)}")
+                linhas.append(f"{nome}_count{_formatar_labels(labels)} {total}")
+        else:
+            for (chave_nome, labels), valor in sorted(contadores.items()):
+                if chave_nome == nome:
+                    linhas.append(f"{nome}{_formatar_labels(labels)} {_numero(valor)}")
+    return "\n".join(linhas) + "\n"
+
+def resumo_etapas():
+    """{operação: {etapa: {"count": n, "mean_ms": média}}} a partir dos histogramas de etapa (usado pelos benchmarks)."""
+    resumo = {}
+    with _lock:
+        for (nome, labels), (_, soma, total) in _histogramas.items():
+            if nome != "inspectorum_stage_duration_seconds" or not total:
+                continue
+            rotulos = dict(labels)
+            resumo.setdefault(rotulos["operation"], {})[rotulos["stage"]] = {"count": total, "mean_ms": soma / total * 1000}
+    return resumo
@@ -0,0 +1,149 @@
+import time
+import sqlite3
+import threading
+import numpy as np
+from concurrent.futures import Future
+from database import conexao
+from classification_cache import hash_texto
+
+# --- CONFIGURAÇÕES ---
+RAG_CACHE_MAX_ENTRIES = 500
+RAG_CACHE_TTL_SECONDS = 7 * 24 * 3600
+# Similaridade de cosseno mínima para considerar duas perguntas equivalentes
+RAG_CACHE_SIMILARITY_THRESHOLD = 0.95
+# O horário do último uso (que decide o descarte) só é regravado se estiver mais velho que isto,
+# para que as consultas que acertam o cache não abram uma transação de escrita a cada vez.
+RAG_CACHE_TOUCH_INTERVAL = 3600
+
+def normalizar_pergunta(pergunta):
+    pergunta = " ".join((pergunta or "").lower().split())
+    return pergunta.rstrip("?!. ")
+
+def _resposta(row):
+    return {"answer": row[0], "sources": row[1]}
+
+def _limpar_expirados(cursor, index_version):
+    """Remove entradas de outra versão do índice ou além do TTL (chamado apenas ao gravar)."""
+    limite = time.time() - RAG_CACHE_TTL_SECONDS
+    cursor.execute("DELETE FROM rag_answer_cache WHERE index_version != ? OR created_at < ?", (index_version, limite))
+
+def _marcar_uso(question_hash, last_used_at):
+    agora = time.time()
+    if agora - last_used_at < RAG_CACHE_TOUCH_INTERVAL:
+        return
+    with conexao() as conn:
+        conn.execute("UPDATE rag_answer_cache SET last_used_at = ? WHERE question_hash = ?", (agora, question_hash))
+
+def buscar_resposta_exata(pergunta, index_version):
+    """
+    Procura uma resposta para a mesma pergunta (após normalização), sem calcular embeddings.
+    A consulta só lê o banco: entradas expiradas são ignoradas aqui e removidas em salvar_resposta.
+    """
+    question_hash = hash_texto(normalizar_pergunta(pergunta))
+    try:
+        with conexao() as conn:
+            row = conn.execute(
+                "SELECT answer, sources, last_used_at FROM rag_answer_cache WHERE question_hash = ? AND index_version = ? AND created_at >= ?",
+                (question_hash, index_version, time.time() - RAG_CACHE_TTL_SECONDS)
+            ).fetchone()
+        if row is None:
+            return None
+        _marcar_uso(question_hash, row[2])
+        return _resposta(row)
+    except sqlite3.Error as e:
+        print(f"Erro ao consultar o cache de respostas do RAG: {e}")
+        return None
+
+def buscar_resposta_semelhante(vetor, index_version, limiar=RAG_CACHE_SIMILARITY_THRESHOLD):
+    """Procura a pergunta armazenada mais parecida com 'vetor'; retorna a resposta se passar do limiar."""
+    try:
+        with conexao() as conn:
+            rows = conn.execute(
+                "SELECT question_hash, embedding, answer, sources, last_used_at FROM rag_answer_cache WHERE index_version = ? AND created_at >= ?",
+                (index_version, time.time() - RAG_CACHE_TTL_SECONDS)
+            ).fetchall()
+        if not rows:
+            return None
+
+        consulta = np.asarray(vetor, dtype=np.float32)
+        consulta /= (np.linalg.norm(consulta) or 1.0)
+        matriz = np.stack([np.frombuffer(row[1], dtype=np.float32) for row in rows])
+        matriz = matriz / np.maximum(np.linalg.norm(matriz, axis=1, keepdims=True), 1e-12)
+        similaridades = matriz @ consulta
+        melhor = int(np.argmax(similaridades))
+        if similaridades[melhor] < limiar:
+            return None
+
+        _marcar_uso(rows[melhor][0], rows[melhor][4])
+        print(f"Cache do RAG: pergunta semelhante encontrada (similaridade {similaridades[melhor]:.3f}).")
+        return _resposta(rows[melhor][2:4])
+    except sqlite3.Error as e:
+        print(f"Erro ao consultar o cache de respostas do RAG: {e}")
+        return None
+
+def salvar_resposta(pergunta, vetor, answer, sources, index_version):
+    """Grava a resposta no cache e remove as entradas expiradas e as usadas há mais tempo além do limite."""
+    question_hash = hash_texto(normalizar_pergunta(pergunta))
+    agora = time.time()
+    try:
+        with conexao() as conn:
+            cursor = conn.cursor()
+            _limpar_expirados(cursor, index_version)
+            cursor.execute(
+                "INSERT OR REPLACE INTO rag_answer_cache (question_hash, question, embedding, answer, sources, index_version, created_at, last_used_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (question_hash, pergunta, np.asarray(vetor, dtype=np.float32).tobytes(), answer, sources, index_version, agora, agora)
+            )
+            cursor.execute(
+                """
+                DELETE FROM rag_answer_cache WHERE question_hash IN (
+                    SELECT question_hash FROM rag_answer_cache
+                    ORDER BY last_used_at DESC LIMIT -1 OFFSET ?
+                )
+                """,
+                (RAG_CACHE_MAX_ENTRIES,)
+            )
+    except sqlite3.Error as e:
+        print(f"Erro ao gravar no cache de respostas do RAG: {e}")
+
+# --- AGRUPAMENTO DE PERGUNTAS SIMULTÂNEAS ---
+# Perguntas idênticas que chegam enquanto a primeira ainda está sendo gerada
+# esperam por ela em vez de iniciar outra geração no LLM.
+_em_andamento = {}
+_em_andamento_lock = threading.Lock()
+
+def iniciar_geracao(pergunta):
+    """
+    Registra a geração de uma resposta. Retorna (future, lider): se 'lider' for False,
+    outra requisição já está gerando a mesma pergunta e basta aguardar future.result().
+    """
+    chave = normalizar_pergunta(pergunta)
+    with _em_andamento_lock:
+        future = _em_andamento.get(chave)
+        if future is not None:
+            return future, False
+        future = Future()
+        _em_andamento[chave] = future
+        return future, True
+
+def concluir_geracao(pergunta, future, resultado=None, erro=None):
+    """Libera as requisições que aguardavam a pergunta, com o resultado ou o erro do líder."""
+    with _em_andamento_lock:
+        _em_andamento.pop(normalizar_pergunta(pergunta), None)
+    if erro is not None:
+        future.set_exception(erro)
+    else:
+        future.set_result(resultado)
+
+def coalesce(pergunta, gerar):
+    """Executa 'gerar()' uma única vez para perguntas idênticas simultâneas."""
+    future, lider = iniciar_geracao(pergunta)
+    if not lider:
+        print("Cache do RAG: aguardando uma geração em andamento para a mesma pergunta.")
+        return future.result()
+    try:
+        resultado = gerar()
+    except Exception as e:
+        concluir_geracao(pergunta, future, erro=e)
+        raise
+    concluir_geracao(pergunta, future, resultado=resultado)
+    return resultado
@@ -0,0 +1,104 @@
+import os
+
+# --- CONFIGURAÇÕES ---
+# Orçamento de tokens do contexto enviado ao LLM. O phi3 tem janela de 4k tokens, que precisa
+# acomodar também as instruções do prompt, a pergunta e a resposta gerada.
+RAG_CONTEXT_TOKEN_BUDGET = 1800
+# Estimativa de caracteres por token para textos em português (sem carregar o tokenizador do modelo)
+CHARS_POR_TOKEN = 3.5
+# Similaridade (Jaccard entre trigramas de palavras) a partir da qual dois trechos são considerados repetidos
+LIMIAR_DUPLICATA = 0.7
+# Maior sobreposição procurada ao juntar trechos vizinhos (o splitter usa chunk_overlap=100)
+MAX_SOBREPOSICAO = 150
+
+def estimar_tokens(texto):
+    return max(1, round(len(texto) / CHARS_POR_TOKEN))
+
+def _chave_origem(doc):
+    return (os.path.basename(str(doc.metadata.get('source', ''))), doc.metadata.get('page'))
+
+def _sobreposicao(a, b):
+    """Tamanho do maior sufixo de 'a' que também é prefixo de 'b'."""
+    for tamanho in range(min(len(a), len(b), MAX_SOBREPOSICAO), 19, -1):
+        if a.endswith(b[:tamanho]):
+            return tamanho
+    return 0
+
+def juntar_vizinhos(documentos):
+    """
+    Junta trechos da mesma fonte e página que se sobrepõem (vizinhos no texto original),
+    eliminando o texto repetido pela sobreposição do splitter. Mantém a ordem de relevância.
+    """
+    resultado = []
+    for doc in documentos:
+        for existente in resultado:
+            if _chave_origem(existente) != _chave_origem(doc):
+                continue
+            texto_a, texto_b = existente.page_content, doc.page_content
+            if texto_b in texto_a:
+                break
+            if (n := _sobreposicao(texto_a, texto_b)):
+                existente.page_content = texto_a + texto_b[n:]
+                break
+            if (n := _sobreposicao(texto_b, texto_a)):
+                existente.page_content = texto_b + texto_a[n:]
+                break
+        else:
+            resultado.append(type(doc)(page_content=doc.page_content, metadata=dict(doc.metadata)))
+    return resultado
+
+def _trigramas(texto):
+    palavras = texto.lower().split()
+    return {tuple(palavras[i:i + 3]) for i in range(max(1, len(palavras) - 2))}
+
+def remover_duplicatas(documentos, limiar=LIMIAR_DUPLICATA):
+    """Descarta trechos quase idênticos a um trecho mais relevante (ex.: a mesma passagem em dois PDFs)."""
+    mantidos, assinaturas = [], []
+    for doc in documentos:
+        assinatura = _trigramas(doc.page_content)
+        repetido = any(
+            len(assinatura & outra) / max(1, len(assinatura | outra)) >= limiar
+            for outra in assinaturas
+        )
+        if not repetido:
+            mantidos.append(doc)
+            assinaturas.append(assinatura)
+    return mantidos
+
+def empacotar(documentos, orcamento_tokens):
+    """Seleciona os trechos, em ordem de relevância, até esgotar o orçamento de tokens."""
+    selecionados, usados = [], 0
+    for doc in documentos:
+        tokens = estimar_tokens(doc.page_content)
+        if usados + tokens <= orcamento_tokens:
+            selecionados.append(doc)
+            usados += tokens
+        elif not selecionados:
+            # Garante ao menos um trecho, cortado para caber no orçamento
+            limite = int(orcamento_tokens * CHARS_POR_TOKEN)
+            selecionados.append(type(doc)(page_content=doc.page_content[:limite], metadata=dict(doc.metadata)))
+            usados = orcamento_tokens
+            break
+    return selecionados, usados
+
+def montar_contexto(documentos, orcamento_tokens=RAG_CONTEXT_TOKEN_BUDGET):
+    """
+    Prepara os trechos recuperados para o prompt: junta vizinhos, remove repetições e
+    empacota no orçamento de tokens. Os documentos devem vir em ordem de relevância
+    (já diversificados por MMR). Retorna (trechos selecionados, estatísticas).
+    """
+    tokens_originais = sum(estimar_tokens(doc.page_content) for doc in documentos)
+    unidos = juntar_vizinhos(documentos)
+    unicos = remover_duplicatas(unidos)
+    selecionados, tokens_usados = empacotar(unicos, orcamento_tokens)
+
+    estatisticas = {
+        "trechos_recuperados": len(documentos),
+        "trechos_enviados": len(selecionados),
+        "tokens_originais": tokens_originais,
+        "tokens_enviados": tokens_usados,
+        "tokens_economizados": tokens_originais - tokens_usados,
+    }
+    print(f"Contexto do RAG: {len(selecionados)}/{len(documentos)} trechos, "
+          f"~{tokens_usados} tokens (~{estatisticas['tokens_economizados']} economizados).")
+    return selecionados, estatisticas
@@ -1,10 +1,20 @@
 import os
 import glob
+import json
+import uuid
+import shutil
+import pickle
+import hashlib
+import faiss
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from embedding_cache import embed_documents_cached
+from metrics import cronometrar
+from lexical_index import LEXICAL_INDEX_FILE, abrir_indice_lexical, adicionar_documentos, remover_documentos
 from langchain_community.document_loaders import PyPDFLoader
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain_huggingface import HuggingFaceEmbeddings
 from langchain_community.vectorstores import FAISS
-from langchain_ollama import OllamaLLM
+from llm_clients import get_llm
 from langchain.chains import RetrievalQAWithSourcesChain
 from langchain.prompts import PromptTemplate
 import time
@@ -14,17 +24,290 @@ import threading
 INDEX_PATH = "faiss_index_mistral"
 PDF_DIRECTORY_PATH = "documentos"
 EMBEDDING_MODEL_NAME = "sentence-transformers/paraphrase-multilingual-mpnet-base-v2"
-LLM_MODEL_NAME = "phi3:3.8b-mini-4k-instruct-q4_0"
+
+MANIFEST_FILE_NAME = "manifest.json"
+INGEST_WORKERS = max(1, (os.cpu_count() or 2) - 1)  # processos que extraem e dividem os PDFs
+EMBEDDING_BATCH_SIZE = 64  # trechos por chamada ao modelo de embeddings
+
+# Tipos de índice FAISS. O índice "flat" (busca exata) é sempre mantido, pois é ele que
+# recebe as atualizações incrementais; os demais são derivados dele a cada construção.
+#   flat  -> IndexFlatL2, float32, busca exaustiva (padrão)
+#   hnsw  -> grafo HNSW, busca aproximada rápida, um pouco mais de memória que o flat
+#   ivfpq -> IVF com Product Quantization, bem menor em memória, busca aproximada
+#   sq8   -> quantização escalar de 8 bits (1/4 da memória do flat)
+#   fp16  -> vetores em float16 (metade da memória do flat)
+INDEX_TYPES = ("flat", "hnsw", "ivfpq", "sq8", "fp16")
+DERIVED_INDEX_TYPES = ()  # tipos extras gerados por build_index, ex.: ("hnsw", "sq8")
+# Tipo usado pelo servidor nas consultas; build_index sempre o gera, além dos tipos que já existiam
+CONFIGURED_INDEX_TYPE = os.environ.get("INSPECTORUM_INDEX_TYPE", "flat")
+HNSW_M = 32
+HNSW_EF_SEARCH = 64
+IVF_NPROBE = 16
+PQ_M = 64  # subquantizadores do PQ; precisa dividir a dimensão dos embeddings (768)
+
+# --- MANIFESTO DO ÍNDICE ---
+# O manifesto registra, para cada PDF indexado, o hash do seu conteúdo e os ids
+# dos trechos (chunks) correspondentes no docstore do FAISS. Com ele, a construção
+# incremental sabe exatamente o que adicionar, reprocessar ou remover.
+
+def hash_file(path):
+    """Calcula o SHA-256 do conteúdo de um arquivo, lendo em blocos."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for bloco in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(bloco)
+    return digest.hexdigest()
+
+def nome_documento(source):
+    """Normaliza o caminho salvo nos metadados (inclusive caminhos do Windows) para o nome do arquivo."""
+    return os.path.basename(source.replace("\\", "/"))
+
+def carregar_manifesto(index_path=INDEX_PATH):
+    manifest_path = os.path.join(index_path, MANIFEST_FILE_NAME)
+    if not os.path.exists(manifest_path):
+        return None
+    with open(manifest_path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def manifesto_a_partir_do_indice(vectorstore, pdf_files):
+    """
+    Reconstrói o manifesto de um índice antigo (criado sem manifesto), agrupando os ids
+    do docstore pela fonte de cada trecho. Considera que os PDFs atuais são os indexados.
+    """
+    ids_por_arquivo = {}
+    for doc_id in vectorstore.index_to_docstore_id.values():
+        doc = vectorstore.docstore.search(doc_id)
+        source = nome_documento(doc.metadata.get('source', ''))
+        ids_por_arquivo.setdefault(source, []).append(doc_id)
+
+    arquivos = {}
+    for pdf_file in pdf_files:
+        nome = os.path.basename(pdf_file)
+        if nome in ids_por_arquivo:
+            arquivos[nome] = {"sha256": hash_file(pdf_file), "ids": ids_por_arquivo[nome]}
+    return {"embedding_model": EMBEDDING_MODEL_NAME, "files": arquivos}
+
+# --- TIPOS DE ÍNDICE ---
+def caminho_indice(index_path, index_type):
+    if index_type == "flat":
+        return os.path.join(index_path, "index.faiss")
+    return os.path.join(index_path, f"index_{index_type}.faiss")
+
+def criar_indice_derivado(flat_index, index_type):
+    """Cria um índice do tipo pedido com os mesmos vetores (e na mesma ordem) do índice flat."""
+    dimensao, total = flat_index.d, flat_index.ntotal
+    vetores = flat_index.reconstruct_n(0, total)
+
+    if index_type == "hnsw":
+        index = faiss.IndexHNSWFlat(dimensao, HNSW_M)
+        index.hnsw.efSearch = HNSW_EF_SEARCH
+    elif index_type == "ivfpq":
+        nlist = max(1, min(int(4 * total ** 0.5), total // 39))
+        if total < 256 or dimensao % PQ_M != 0:
+            print(f"[AVISO] Vetores insuficientes ou dimensão incompatível para IVF-PQ. Índice '{index_type}' não gerado.")
+            return None
+        quantizer = faiss.IndexFlatL2(dimensao)
+        index = faiss.IndexIVFPQ(quantizer, dimensao, nlist, PQ_M, 8)
+        index.nprobe = IVF_NPROBE
+    elif index_type == "sq8":
+        index = faiss.IndexScalarQuantizer(dimensao, faiss.ScalarQuantizer.QT_8bit)
+    elif index_type == "fp16":
+        index = faiss.IndexScalarQuantizer(dimensao, faiss.ScalarQuantizer.QT_fp16)
+    else:
+        raise ValueError(f"Tipo de índice desconhecido: '{index_type}'. Opções: {', '.join(INDEX_TYPES)}")
+
+    if not index.is_trained:
+        index.train(vetores)
+    index.add(vetores)
+    if index_type == "ivfpq":
+        # Permite reconstruir vetores pelo id, necessário para a diversificação por MMR
+        index.make_direct_map()
+    return index
+
+def tipos_derivados_existentes(index_path=INDEX_PATH):
+    return [t for t in INDEX_TYPES if t != "flat" and os.path.exists(caminho_indice(index_path, t))]
+
+def salvar_indices_derivados(flat_index, index_path, index_types):
+    for index_type in index_types:
+        if index_type == "flat":
+            continue
+        print(f"Gerando o índice derivado '{index_type}'...")
+        index = criar_indice_derivado(flat_index, index_type)
+        if index is not None:
+            destino = caminho_indice(index_path, index_type)
+            faiss.write_index(index, destino + ".tmp")
+            os.replace(destino + ".tmp", destino)
+
+def ler_indice(caminho, mmap=False):
+    """
+    Lê um índice FAISS e retorna (índice, mapeado). Com 'mmap', usa IO_FLAG_MMAP_IFC (faiss >= 1.8),
+    que mapeia os vetores dos índices flat, hnsw, sq8 e fp16 a partir do disco. Em versões antigas
+    só existe IO_FLAG_MMAP, que mapeia apenas as listas invertidas dos índices IVF: os demais tipos
+    continuam sendo lidos por inteiro, e 'mapeado' é False.
+    """
+    if mmap:
+        flag_vetores = getattr(faiss, "IO_FLAG_MMAP_IFC", None)
+        tentativas = ([flag_vetores] if flag_vetores is not None else []) + [faiss.IO_FLAG_MMAP]
+        for flag in tentativas:
+            try:
+                index = faiss.read_index(caminho, flag | faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+            except RuntimeError as e:
+                print(f"[AVISO] Não foi possível mapear '{caminho}' em memória ({e}).")
+                continue
+            return index, flag == flag_vetores or isinstance(index, faiss.IndexIVF)
+        print(f"[AVISO] Lendo '{caminho}' inteiro na memória.")
+    return faiss.read_index(caminho), False
+
+def carregar_vectorstore(embeddings, index_path=INDEX_PATH, index_type="flat", mmap=False):
+    """
+    Carrega o vectorstore do disco usando o tipo de índice escolhido. Com 'mmap', o arquivo
+    do índice é mapeado em memória em vez de lido por inteiro, reduzindo o tempo de carga e a RAM residente.
+    Se o índice derivado não existir, usa o flat.
+    """
+    caminho = caminho_indice(index_path, index_type)
+    if not os.path.exists(caminho):
+        print(f"[AVISO] Índice '{index_type}' não encontrado em '{caminho}'. Usando o índice flat.")
+        caminho = caminho_indice(index_path, "flat")
+
+    index, mapeado = ler_indice(caminho, mmap)
+    if mmap and not mapeado:
+        print(f"[AVISO] Esta versão do faiss não mapeia '{caminho}' em memória; o índice foi lido por inteiro.")
+
+    if hasattr(index, "hnsw"):
+        index.hnsw.efSearch = HNSW_EF_SEARCH
+    elif isinstance(index, faiss.IndexIVF):
+        index.nprobe = IVF_NPROBE
+
+    with open(os.path.join(index_path, "index.pkl"), "rb") as f:
+        docstore, index_to_docstore_id = pickle.load(f)
+    return FAISS(embeddings, index, docstore, index_to_docstore_id)
+
+# --- ÍNDICE LEXICAL (BM25) ---
+def indexar_docstore_lexical(conn, vectorstore):
+    """Indexa no BM25 todos os trechos já presentes no docstore (índices criados antes do BM25)."""
+    ids = list(vectorstore.index_to_docstore_id.values())
+    textos = [vectorstore.docstore.search(doc_id).page_content for doc_id in ids]
+    adicionar_documentos(conn, ids, textos)
+
+def preparar_indice_lexical(vectorstore, destino, index_path=INDEX_PATH):
+    """
+    Prepara em 'destino' uma cópia de trabalho do índice BM25 correspondente ao 'vectorstore'.
+    Se o índice atual não tiver BM25, ele é criado a partir do docstore.
+    """
+    if os.path.exists(destino):
+        os.remove(destino)
+    atual = os.path.join(index_path, LEXICAL_INDEX_FILE)
+    if vectorstore is not None and os.path.exists(atual):
+        shutil.copy2(atual, destino)
+        return abrir_indice_lexical(destino)
+
+    conn = abrir_indice_lexical(destino)
+    if vectorstore is not None:
+        print("[INFO] Criando o índice lexical (BM25) a partir do docstore existente...")
+        indexar_docstore_lexical(conn, vectorstore)
+    return conn
+
+def salvar_indice_atomico(vectorstore, manifesto, index_path=INDEX_PATH, index_types=DERIVED_INDEX_TYPES, lexical_path=None):
+    """
+    Salva o índice, os índices derivados e o manifesto em uma pasta temporária e só então
+    a coloca no lugar da pasta atual, para que uma falha no meio da gravação não deixe um índice corrompido.
+    """
+    tmp_path = index_path + ".tmp"
+    old_path = index_path + ".old"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    shutil.rmtree(old_path, ignore_errors=True)
+
+    vectorstore.save_local(tmp_path)
+    salvar_indices_derivados(vectorstore.index, tmp_path, index_types)
+    if lexical_path:
+        shutil.move(lexical_path, os.path.join(tmp_path, LEXICAL_INDEX_FILE))
+    with open(os.path.join(tmp_path, MANIFEST_FILE_NAME), 'w', encoding='utf-8') as f:
+        json.dump(manifesto, f, ensure_ascii=False, indent=2)
+
+    if os.path.exists(index_path):
+        os.rename(index_path, old_path)
+    os.rename(tmp_path, index_path)
+    shutil.rmtree(old_path, ignore_errors=True)
+
+def carregar_e_dividir_pdf(pdf_file):
+    """
+    Carrega um PDF e o divide em trechos prontos para gerar embeddings.
+    Retorna (nome do arquivo, trechos, número de páginas). Roda nos processos de ingestão.
+    """
+    loader = PyPDFLoader(pdf_file)
+    pages = loader.load()
+    text_splitter = RecursiveCharacterTextSplitter(chunk_size=750, chunk_overlap=100)
+    return os.path.basename(pdf_file), text_splitter.split_documents(pages), len(pages)
+
+# --- PIPELINE DE INGESTÃO ---
+def ingerir_pdfs(pdf_files, workers=INGEST_WORKERS):
+    """
+    Extrai e divide os PDFs em paralelo (um processo por arquivo), entregando cada
+    resultado assim que fica pronto. No máximo 'workers' * 2 arquivos ficam em
+    andamento ou aguardando consumo, o que mantém a memória limitada.
+    Com 'workers' <= 1, tudo roda no processo atual, um arquivo por vez.
+    """
+    if workers <= 1:
+        for pdf_file in pdf_files:
+            yield carregar_e_dividir_pdf(pdf_file)
+        return
+
+    pendentes = list(pdf_files)
+    em_andamento = set()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        while pendentes or em_andamento:
+            while pendentes and len(em_andamento) < workers * 2:
+                em_andamento.add(pool.submit(carregar_e_dividir_pdf, pendentes.pop(0)))
+            concluidos, em_andamento = wait(em_andamento, return_when=FIRST_COMPLETED)
+            for future in concluidos:
+                yield future.result()
+
+def adicionar_em_lotes(vectorstore, embeddings, texts, ids, batch_size=EMBEDDING_BATCH_SIZE):
+    """
+    Gera os embeddings em lotes de tamanho fixo e os adiciona ao índice conforme ficam prontos.
+    Trechos cujo texto já foi processado antes vêm do cache de embeddings em disco.
+    Retorna (vectorstore, quantidade de trechos vindos do cache).
+    """
+    acertos_cache = 0
+    for i in range(0, len(texts), batch_size):
+        lote, lote_ids = texts[i:i + batch_size], ids[i:i + batch_size]
+        conteudos = [t.page_content for t in lote]
+        with cronometrar("build_index", "embedding"):
+            vetores, acertos = embed_documents_cached(embeddings, EMBEDDING_MODEL_NAME, conteudos)
+        acertos_cache += acertos
+        pares = list(zip(conteudos, vetores))
+        metadados = [t.metadata for t in lote]
+        with cronometrar("build_index", "faiss_add"):
+            if vectorstore is None:
+                vectorstore = FAISS.from_embeddings(pares, embeddings, metadatas=metadados, ids=lote_ids)
+            else:
+                vectorstore.add_embeddings(pares, metadatas=metadados, ids=lote_ids)
+    return vectorstore, acertos_cache
 
 # --- FUNÇÃO PRINCIPAL DE CONSTRUÇÃO DO ÍNDICE ---
-def build_index():
+def build_index(incremental=False, workers=INGEST_WORKERS, index_types=DERIVED_INDEX_TYPES):
+    """Constrói ou atualiza o índice (ver _construir_indice), registrando a duração total nas métricas."""
+    with cronometrar("build_index", "total"):
+        return _construir_indice(incremental, workers, index_types)
+
+def _construir_indice(incremental, workers, index_types):
     """
-    Verifica a pasta 'documentos', carrega os PDFs,
-    e cria um novo índice FAISS do zero.
+    Verifica a pasta 'documentos', carrega os PDFs e cria o índice FAISS.
+
+    Sem 'incremental', o índice é criado do zero e a construção é pulada se ele já existir.
+    Com 'incremental', compara o hash de cada PDF com o manifesto e só gera embeddings
+    para arquivos novos ou alterados, removendo os vetores de arquivos apagados.
+    Os PDFs são extraídos em paralelo por 'workers' processos e os embeddings são
+    gerados em lotes de EMBEDDING_BATCH_SIZE à medida que os trechos chegam.
+    Para cada tipo em 'index_types' (ex.: "hnsw", "ivfpq", "sq8", "fp16") também é salvo um
+    índice derivado, que pode ser escolhido no servidor. Os tipos derivados que já existiam e o
+    tipo configurado em INSPECTORUM_INDEX_TYPE são sempre regerados, para não sumirem na nova pasta.
+    O índice lexical (BM25) é atualizado junto, com os mesmos ids de trechos do docstore.
     """
     print("--- Iniciando construção do índice FAISS ---")
     
-    if os.path.exists(os.path.join(INDEX_PATH, "index.faiss")):
+    index_exists = os.path.exists(os.path.join(INDEX_PATH, "index.faiss"))
+    if index_exists and not incremental:
         print(f"[INFO] O índice em '{INDEX_PATH}' já existe. Construção pulada.")
         return
 
@@ -33,35 +316,93 @@ def build_index():
         print("Por favor, adicione arquivos PDF para construir o índice.")
         return
 
-    print(f"Carregando documentos da pasta '{PDF_DIRECTORY_PATH}'...")
-    all_pdf_files = glob.glob(os.path.join(PDF_DIRECTORY_PATH, "*.pdf"))
-    
-    documents = []
-    for pdf_file in all_pdf_files:
-        loader = PyPDFLoader(pdf_file)
-        documents.extend(loader.load())
-    
-    if not documents:
+    all_pdf_files = sorted(glob.glob(os.path.join(PDF_DIRECTORY_PATH, "*.pdf")))
+    configurado = [CONFIGURED_INDEX_TYPE] if CONFIGURED_INDEX_TYPE in INDEX_TYPES else []
+    index_types = tuple(dict.fromkeys([*index_types, *tipos_derivados_existentes(), *configurado]))
+    embeddings = None
+    vectorstore = None
+    manifesto = {"embedding_model": EMBEDDING_MODEL_NAME, "files": {}}
+
+    if index_exists:
+        embeddings = HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL_NAME)
+        with cronometrar("build_index", "load_index"):
+            vectorstore = FAISS.load_local(INDEX_PATH, embeddings, allow_dangerous_deserialization=True)
+        manifesto = carregar_manifesto()
+        if manifesto is None:
+            print("[INFO] Índice sem manifesto. Reconstruindo o manifesto a partir do docstore...")
+            manifesto = manifesto_a_partir_do_indice(vectorstore, all_pdf_files)
+        elif manifesto.get("embedding_model") != EMBEDDING_MODEL_NAME:
+            print("[INFO] O modelo de embeddings mudou. O índice será reconstruído do zero.")
+            vectorstore = None
+            manifesto = {"embedding_model": EMBEDDING_MODEL_NAME, "files": {}}
+
+    hashes_atuais = {os.path.basename(f): hash_file(f) for f in all_pdf_files}
+    arquivos_indexados = manifesto["files"]
+    removidos = [nome for nome in arquivos_indexados if nome not in hashes_atuais]
+    alterados = [nome for nome in arquivos_indexados if nome in hashes_atuais and arquivos_indexados[nome]["sha256"] != hashes_atuais[nome]]
+    novos = [nome for nome in hashes_atuais if nome not in arquivos_indexados]
+
+    lexical_path = INDEX_PATH + ".lexical.tmp"
+    if not (removidos or alterados or novos):
+        faltando = [t for t in index_types if t != "flat" and not os.path.exists(caminho_indice(INDEX_PATH, t))]
+        if faltando:
+            salvar_indices_derivados(vectorstore.index, INDEX_PATH, faltando)
+        if not os.path.exists(os.path.join(INDEX_PATH, LEXICAL_INDEX_FILE)):
+            preparar_indice_lexical(vectorstore, lexical_path).close()
+            os.replace(lexical_path, os.path.join(INDEX_PATH, LEXICAL_INDEX_FILE))
+        print("[INFO] Nenhum PDF novo, alterado ou removido. O índice já está atualizado.")
+        return
+
+    print(f"Novos: {len(novos)} | Alterados: {len(alterados)} | Removidos: {len(removidos)}")
+
+    ids_para_remover = []
+    for nome in removidos + alterados:
+        ids_para_remover.extend(arquivos_indexados.pop(nome)["ids"])
+    lexical_conn = preparar_indice_lexical(vectorstore, lexical_path)
+    if vectorstore is not None and ids_para_remover:
+        print(f"Removendo {len(ids_para_remover)} trechos de documentos removidos ou alterados...")
+        vectorstore.delete(ids_para_remover)
+        remover_documentos(lexical_conn, ids_para_remover)
+
+    if embeddings is None:
+        embeddings = HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL_NAME)
+
+    print("Gerando embeddings e atualizando o índice (isso pode levar alguns minutos)...")
+    pdf_files = [os.path.join(PDF_DIRECTORY_PATH, nome) for nome in alterados + novos]
+    inicio = time.perf_counter()
+    total_paginas = total_trechos = 0
+    for nome, texts, paginas in ingerir_pdfs(pdf_files, workers):
+        if not texts:
+            print(f"[AVISO] Nenhum texto pôde ser extraído de '{nome}'.")
+            continue
+        ids = [str(uuid.uuid4()) for _ in texts]
+        vectorstore, acertos_cache = adicionar_em_lotes(vectorstore, embeddings, texts, ids)
+        adicionar_documentos(lexical_conn, ids, [t.page_content for t in texts])
+        arquivos_indexados[nome] = {"sha256": hashes_atuais[nome], "ids": ids}
+
+        total_paginas += paginas
+        total_trechos += len(texts)
+        decorrido = max(time.perf_counter() - inicio, 1e-9)
+        print(f"  - {nome}: {paginas} páginas, {len(texts)} trechos indexados ({acertos_cache} do cache) "
+              f"[{len(arquivos_indexados)}/{len(hashes_atuais)} arquivos | "
+              f"{total_paginas / decorrido:.1f} pág/s | {total_trechos / decorrido:.1f} trechos/s]")
+
+    lexical_conn.close()
+    if vectorstore is None:
         print("[ERRO] Nenhum documento pôde ser carregado dos arquivos PDF.")
+        os.remove(lexical_path)
         return
-        
-    text_splitter = RecursiveCharacterTextSplitter(chunk_size=750, chunk_overlap=100)
-    texts = text_splitter.split_documents(documents)
-    
-    print("Gerando embeddings e construindo o índice (isso pode levar alguns minutos)...")
-    embeddings = HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL_NAME)
-    vectorstore = FAISS.from_documents(texts, embeddings)
-    
+
     print(f"Salvando o índice em '{INDEX_PATH}'...")
-    os.makedirs(INDEX_PATH, exist_ok=True)
-    vectorstore.save_local(INDEX_PATH)
+    with cronometrar("build_index", "save"):
+        salvar_indice_atomico(vectorstore, manifesto, index_types=index_types, lexical_path=lexical_path)
     
     print("--- ✅ Índice FAISS construído e salvo com sucesso! ---")
 
 
 # --- BLOCO DE EXECUÇÃO PARA TESTE INTERATIVO ---
 if __name__ == "__main__":
-    build_index()
+    build_index(incremental=True)
 
     if not os.path.exists(os.path.join(INDEX_PATH, "index.faiss")):
         print("\n[FALHA] O índice não foi encontrado. Encerrando o chat de teste.")
@@ -69,7 +410,7 @@ if __name__ == "__main__":
         print("\nCarregando o índice e o modelo para o chat de teste...")
         embeddings = HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL_NAME)
         vector_store = FAISS.load_local(INDEX_PATH, embeddings, allow_dangerous_deserialization=True)
-        llm = OllamaLLM(model=LLM_MODEL_NAME)
+        llm = get_llm("rag")
 
         # --- PROMPT DE RAG COMPLETO E RESTAURADO ---
         main_chain_prompt_template = """
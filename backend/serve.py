@@ -0,0 +1,127 @@
+"""
+Ponto de entrada de produção do backend.
+
+    python serve.py                 # waitress, multi-thread (funciona também no Windows)
+    gunicorn -c gunicorn.conf.py api_server:app   # apenas macOS/Linux
+
+Ao contrário de 'python api_server.py' (servidor de desenvolvimento do Flask, com recarregador),
+o modelo e a cadeia de RAG são carregados uma única vez por processo. Ao receber Ctrl+C ou
+SIGTERM, o servidor para de aceitar conexões, espera as requisições em andamento (inclusive as
+respostas em streaming) por até INSPECTORUM_SHUTDOWN_TIMEOUT segundos e só então sai.
+Um segundo Ctrl+C encerra na hora.
+"""
+import os
+import signal
+import threading
+from waitress import create_server
+from waitress.server import BaseWSGIServer
+
+# --- CONFIGURAÇÕES ---
+HOST = os.environ.get("INSPECTORUM_HOST", "127.0.0.1")
+PORT = int(os.environ.get("INSPECTORUM_PORT", "5000"))
+# Threads que atendem requisições. No máximo INSPECTORUM_LLM_CONCURRENCY delas ficam presas numa
+# geração do LLM (ver vaga_llm em api_server.py); as demais ficam livres para o exame e o dashboard.
+THREADS = int(os.environ.get("INSPECTORUM_THREADS", "8"))
+SHUTDOWN_TIMEOUT = int(os.environ.get("INSPECTORUM_SHUTDOWN_TIMEOUT", "30"))
+
+# Em produção o aquecimento é o padrão: o primeiro usuário não espera o carregamento do modelo
+os.environ.setdefault("INSPECTORUM_WARMUP", "1")
+
+class _RespostaAcompanhada:
+    """Repassa o corpo da resposta e avisa quando o servidor termina de enviá-lo (close)."""
+
+    def __init__(self, resultado, ao_fechar):
+        self.resultado = resultado
+        self.ao_fechar = ao_fechar
+
+    def __iter__(self):
+        return iter(self.resultado)
+
+    def close(self):
+        try:
+            if hasattr(self.resultado, "close"):
+                self.resultado.close()
+        finally:
+            self.ao_fechar()
+
+class RequisicoesAtivas:
+    """
+    Middleware WSGI que conta as requisições em andamento. Durante o encerramento, as novas
+    requisições (em conexões já abertas) recebem 503 enquanto as atuais terminam.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.ativas = 0
+        self.encerrando = False
+        self._condicao = threading.Condition()
+
+    def _terminar(self):
+        with self._condicao:
+            self.ativas -= 1
+            self._condicao.notify_all()
+
+    def __call__(self, environ, start_response):
+        with self._condicao:
+            if self.encerrando:
+                start_response("503 Service Unavailable", [("Content-Type", "text/plain; charset=utf-8"), ("Retry-After", "5")])
+                return [b"Servidor em encerramento."]
+            self.ativas += 1
+        try:
+            resultado = self.app(environ, start_response)
+        except BaseException:
+            self._terminar()
+            raise
+        return _RespostaAcompanhada(resultado, self._terminar)
+
+    def encerrar(self, timeout):
+        """Recusa novas requisições e espera as atuais por até 'timeout' segundos. Retorna quantas restam."""
+        with self._condicao:
+            self.encerrando = True
+            self._condicao.wait_for(lambda: self.ativas == 0, timeout)
+            return self.ativas
+
+def _parar_de_aceitar(server):
+    """Deixa de escutar novas conexões; as conexões abertas continuam sendo atendidas."""
+    mapa = getattr(server, "map", None) or getattr(server, "_map", {})
+    for dispatcher in list(mapa.values()):
+        if isinstance(dispatcher, BaseWSGIServer):
+            dispatcher.accepting = False
+
+def main():
+    # Importado aqui para que INSPECTORUM_WARMUP já esteja definido quando o módulo carregar
+    from api_server import app, encerrar_recursos
+
+    requisicoes = RequisicoesAtivas(app)
+    server = create_server(requisicoes, host=HOST, port=PORT, threads=THREADS, channel_timeout=300)
+    estado = {"fase": "servindo"}
+
+    def drenar_e_parar():
+        restantes = requisicoes.encerrar(SHUTDOWN_TIMEOUT)
+        if restantes:
+            print(f"Tempo de encerramento esgotado: {restantes} requisição(ões) em andamento serão interrompidas.")
+        estado["fase"] = "parando"
+        # O laço do waitress roda na thread principal: um novo SIGINT o interrompe por lá
+        signal.raise_signal(signal.SIGINT)
+
+    def ao_receber_sinal(signum, frame):
+        if estado["fase"] != "servindo":
+            # Segundo Ctrl+C, ou fim da espera: o waitress trata o KeyboardInterrupt e sai do laço
+            raise KeyboardInterrupt
+        estado["fase"] = "drenando"
+        print(f"Sinal de encerramento recebido: aguardando as requisições em andamento (até {SHUTDOWN_TIMEOUT}s)...")
+        _parar_de_aceitar(server)
+        threading.Thread(target=drenar_e_parar, daemon=True).start()
+
+    signal.signal(signal.SIGINT, ao_receber_sinal)
+    signal.signal(signal.SIGTERM, ao_receber_sinal)
+    print(f"Servidor Inspectorum em http://{HOST}:{PORT} ({THREADS} threads). Ctrl+C para encerrar.")
+    try:
+        server.run()
+    finally:
+        server.close()
+        # As requisições já terminaram; falta esperar as tarefas em segundo plano e fechar o banco
+        encerrar_recursos(SHUTDOWN_TIMEOUT)
+
+if __name__ == "__main__":
+    main()
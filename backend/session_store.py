@@ -0,0 +1,121 @@
+import os
+import sqlite3
+import yaml
+from datetime import datetime, date
+from database import conexao
+
+# --- ARMAZENAMENTO DAS SESSÕES DE EXAME ---
+# Cada exame é uma sessão em 'exam_sessions' e cada resposta é uma linha nova em
+# 'exam_answers' (somente inserções), no mesmo banco do progresso. Isso substitui o
+# antigo respostas.yaml, que era lido e regravado por inteiro a cada resposta.
+
+def obter_sessao_atual():
+    """Retorna (id, data da última atividade) da sessão aberta, ou None se não houver."""
+    with conexao() as conn:
+        row = conn.execute(
+            """
+            SELECT s.id, COALESCE(MAX(a.answered_at), s.started_at)
+            FROM exam_sessions s LEFT JOIN exam_answers a ON a.session_id = s.id
+            WHERE s.closed_at IS NULL
+            GROUP BY s.id ORDER BY s.id DESC LIMIT 1
+            """
+        ).fetchone()
+    if row is None:
+        return None
+    return row[0], datetime.fromisoformat(row[1]).date()
+
+def criar_sessao(started_at=None):
+    with conexao() as conn:
+        cursor = conn.execute(
+            "INSERT INTO exam_sessions (started_at, exam_date) VALUES (?, ?)",
+            ((started_at or datetime.now()).isoformat(), (started_at or datetime.now()).date().isoformat())
+        )
+    return cursor.lastrowid
+
+def encerrar_sessoes_abertas():
+    """Encerra a sessão em andamento (novo exame ou virada do dia). As respostas continuam no histórico."""
+    with conexao() as conn:
+        conn.execute("UPDATE exam_sessions SET closed_at = ? WHERE closed_at IS NULL", (datetime.now().isoformat(),))
+
+def encerrar_se_de_outro_dia():
+    """Encerra a sessão aberta se a última atividade foi antes de hoje. Retorna a data encerrada, se houver."""
+    sessao = obter_sessao_atual()
+    if sessao and sessao[1] < date.today():
+        encerrar_sessoes_abertas()
+        return sessao[1]
+    return None
+
+def registrar_resposta(question_id, answer):
+    """Acrescenta uma resposta à sessão aberta, criando a sessão se necessário. Retorna (sessão, id da resposta)."""
+    sessao = obter_sessao_atual()
+    session_id = sessao[0] if sessao else criar_sessao()
+    with conexao() as conn:
+        cursor = conn.execute(
+            "INSERT INTO exam_answers (session_id, question_id, answer, answered_at) VALUES (?, ?, ?, ?)",
+            (session_id, question_id, answer, datetime.now().isoformat())
+        )
+    return session_id, cursor.lastrowid
+
+def carregar_respostas(session_id=None):
+    """
+    Retorna as respostas da sessão (por padrão, a aberta) no mesmo formato do antigo
+    respostas.yaml: [{'id_pergunta': ..., 'resposta': ...}], na ordem em que foram dadas.
+    """
+    if session_id is None:
+        sessao = obter_sessao_atual()
+        if sessao is None:
+            return []
+        session_id = sessao[0]
+    with conexao() as conn:
+        rows = conn.execute(
+            "SELECT question_id, answer FROM exam_answers WHERE session_id = ? ORDER BY id", (session_id,)
+        ).fetchall()
+    return [{'id_pergunta': question_id, 'resposta': answer} for question_id, answer in rows]
+
+def carregar_historico(since=0):
+    """
+    Retorna (id da sessão aberta, respostas com id > 'since'), incluindo o id da linha
+    (usado como cursor pelo cliente) e o horário de cada resposta.
+    """
+    sessao = obter_sessao_atual()
+    if sessao is None:
+        return None, []
+    with conexao() as conn:
+        rows = conn.execute(
+            "SELECT id, question_id, answer, answered_at FROM exam_answers WHERE session_id = ? AND id > ? ORDER BY id",
+            (sessao[0], since)
+        ).fetchall()
+    return sessao[0], [
+        {'id': row_id, 'id_pergunta': question_id, 'resposta': answer, 'answered_at': answered_at}
+        for row_id, question_id, answer, answered_at in rows
+    ]
+
+def ids_respondidos(session_id):
+    with conexao() as conn:
+        rows = conn.execute("SELECT DISTINCT question_id FROM exam_answers WHERE session_id = ?", (session_id,)).fetchall()
+    return {row[0] for row in rows}
+
+def migrar_respostas_yaml(caminho='respostas.yaml'):
+    """
+    Migração única: importa um respostas.yaml existente como sessão aberta e renomeia o
+    arquivo para '<nome>.migrado', para que não seja importado novamente.
+    """
+    if not os.path.exists(caminho):
+        return
+    try:
+        with open(caminho, 'r', encoding='utf-8') as f:
+            dados = yaml.safe_load(f) or {}
+        respostas = dados.get('respostas', []) or []
+        data_exame = datetime.fromisoformat(dados['data_exame']) if dados.get('data_exame') else datetime.now()
+
+        encerrar_sessoes_abertas()
+        session_id = criar_sessao(started_at=data_exame)
+        with conexao() as conn:
+            conn.executemany(
+                "INSERT INTO exam_answers (session_id, question_id, answer, answered_at) VALUES (?, ?, ?, ?)",
+                [(session_id, r['id_pergunta'], r['resposta'], data_exame.isoformat()) for r in respostas]
+            )
+        os.replace(caminho, caminho + '.migrado')
+        print(f"{len(respostas)} respostas migradas de '{caminho}' para o banco de dados.")
+    except (yaml.YAMLError, KeyError, ValueError, sqlite3.Error) as e:
+        print(f"Erro ao migrar '{caminho}': {e}")
@@ -4,8 +4,7 @@ import sys
 import ollama
 from database import init_db
 from rag_engineering import build_index, INDEX_PATH # Importa a função e a constante
-
-LLM_MODEL_NAME = "phi3:3.8b-mini-4k-instruct-q4_0"
+from llm_clients import LLM_MODEL_NAME
 
 def run_command(command):
     """Executa um comando no terminal e lida com erros."""
@@ -38,14 +37,14 @@ def setup_application():
     # --- ETAPA 2: ÍNDICE FAISS ---
     print("\n[ETAPA 2 de 3] Verificando o índice vetorial FAISS...")
     if os.path.exists(os.path.join(INDEX_PATH, "index.faiss")):
-        print("[INFO] Índice FAISS já existe. Etapa pulada.")
+        print("[INFO] Índice FAISS já existe. Verificando PDFs novos ou alterados...")
     else:
         print("[INFO] Índice FAISS não encontrado. Construindo agora...")
-        try:
-            build_index()
-        except Exception as e:
-            print(f"[ERRO] Falha ao construir o índice FAISS: {e}")
-            sys.exit(1)
+    try:
+        build_index(incremental=True)
+    except Exception as e:
+        print(f"[ERRO] Falha ao construir o índice FAISS: {e}")
+        sys.exit(1)
             
     # --- ETAPA 3: MODELO OLLAMA ---
     print("\n[ETAPA 3 de 3] Verificando o modelo LLM no Ollama...")
@@ -36,6 +36,31 @@ interface ChatState {
     currentQuestion: Question | null;
 }
 
+// Lê uma resposta Server-Sent Events (SSE) e repassa cada evento já decodificado.
+async function readEventStream(response: Response, onEvent: (event: string, data: any) => void) {
+  if (!response.ok || !response.body) throw new Error(`HTTP error! status: ${response.status}`);
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = "";
+  while (true) {
+    const { done, value } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+    let separator;
+    while ((separator = buffer.indexOf("\n\n")) !== -1) {
+      const rawEvent = buffer.slice(0, separator);
+      buffer = buffer.slice(separator + 2);
+      let event = "message";
+      let data = "";
+      for (const line of rawEvent.split("\n")) {
+        if (line.startsWith("event:")) event = line.slice(6).trim();
+        else if (line.startsWith("data:")) data += line.slice(5).trim();
+      }
+      if (data) onEvent(event, JSON.parse(data));
+    }
+  }
+}
+
 function TypingIndicator() {
   return (
     <div className="flex items-center gap-1.5 p-2">
@@ -54,7 +79,7 @@ export function ChatbotInterface() {
   const [isExamCompleted, setIsExamCompleted] = useState(false);
   const [showLoadingPopup, setShowLoadingPopup] = useState(false);
   const [chatMode, setChatMode] = useState<ChatMode>('exame');
-  const pollingInterval = useRef<NodeJS.Timeout | null>(null);
+  const statusWatcher = useRef<AbortController | null>(null);
   const messagesEndRef = useRef<HTMLDivElement>(null);
 
   const t = {
@@ -157,13 +182,24 @@ export function ChatbotInterface() {
       setIsLoading(true);
       setMessages((prev) => [...prev, userMessage]);
       try {
-        await fetch(`${API_URL}/exame/submit-answer`, {
+        const response = await fetch(`${API_URL}/exame/submit-answer`, {
           method: 'POST', headers: { 'Content-Type': 'application/json' },
           body: JSON.stringify({ question_id: currentQuestion.id, answer: submittedText }),
         });
-        await fetchCurrentState();
+        if (!response.ok) throw new Error(`HTTP error! status: ${response.status}`);
+        // A resposta já traz a próxima pergunta; não é preciso recarregar o histórico inteiro
+        const data = await response.json();
+        const newItems: Message[] = Array.isArray(data.history) ? data.history.map((msg: Message) => ({ ...msg, timestamp: new Date(msg.timestamp) })) : [];
+        setMessages((prev) => [...prev, ...newItems]);
+        if (data.status === "completed") {
+          setIsExamCompleted(true);
+          setCurrentQuestion(null);
+        } else {
+          setCurrentQuestion(data.next_question);
+        }
       } catch (error) {
         console.error("Falha ao enviar resposta do exame:", error);
+      } finally {
         setIsLoading(false);
       }
     } else if (chatMode === 'rag') {
@@ -174,18 +210,30 @@ export function ChatbotInterface() {
       };
       setMessages((prev) => [...prev, userMessage, loadingMessage]);
 
+      const ragMessageId = Date.now().toString() + "-rag";
       try {
-        const response = await fetch(`${API_URL}/rag/query`, {
+        const response = await fetch(`${API_URL}/rag/query/stream`, {
           method: 'POST', headers: { 'Content-Type': 'application/json' },
           body: JSON.stringify({ question: submittedText }),
         });
-        const data = await response.json();
-        const ragResponse: Message = {
-            id: Date.now().toString() + "-rag", type: 'ai',
-            content: data.answer ? `${data.answer}\n\nFontes: ${data.sources || 'N/A'}` : "Desculpe, não consegui processar sua pergunta.",
-            categoria: 'Assistente de Doutrina', timestamp: new Date()
-        };
-        setMessages((prev) => [...prev.filter(m => m.id !== 'rag-loading'), ragResponse]);
+        let answer = "";
+        await readEventStream(response, (event, data) => {
+          if (event === "token") {
+            answer += data.text;
+          } else if (event === "sources") {
+            answer = `${data.answer}\n\nFontes: ${data.sources || 'N/A'}`;
+          } else if (event === "error") {
+            throw new Error(data.error);
+          } else {
+            return;
+          }
+          const ragResponse: Message = {
+              id: ragMessageId, type: 'ai', content: answer,
+              categoria: 'Assistente de Doutrina', timestamp: new Date()
+          };
+          setMessages((prev) => [...prev.filter(m => m.id !== 'rag-loading' && m.id !== ragMessageId), ragResponse]);
+        });
+        if (!answer) throw new Error("Resposta vazia do assistente.");
       } catch(error) {
          console.error("Falha ao enviar pergunta RAG:", error);
          const errorResponse: Message = {
@@ -193,32 +241,42 @@ export function ChatbotInterface() {
             content: "Ocorreu um erro ao processar sua pergunta. Por favor, tente novamente.",
             categoria: 'Erro do Sistema', timestamp: new Date()
         };
-        setMessages((prev) => [...prev.filter(m => m.id !== 'rag-loading'), errorResponse]);
+        setMessages((prev) => [...prev.filter(m => m.id !== 'rag-loading' && m.id !== ragMessageId), errorResponse]);
       } finally {
         setIsLoading(false);
       }
     }
   };
   
-  const startStatusPolling = () => {
-    if (pollingInterval.current) clearInterval(pollingInterval.current);
-    pollingInterval.current = setInterval(async () => {
-      try {
-        const response = await fetch(`${API_URL}/dashboard/status`);
-        const statusData = await response.json();
-        if (statusData.status === "idle") {
-          console.log("Análise em background concluída!");
-          if (pollingInterval.current) clearInterval(pollingInterval.current);
-          setShowLoadingPopup(false);
-        } else {
-          console.log("Backend ainda processando a análise de progresso...");
+  // Acompanha a tarefa de salvamento do progresso com espera longa: cada requisição só
+  // retorna quando a tarefa muda (ou após o tempo máximo), em vez de consultar a cada poucos segundos.
+  const waitForJob = async (jobId: string) => {
+    statusWatcher.current?.abort();
+    const controller = new AbortController();
+    statusWatcher.current = controller;
+    let version = -1;
+    try {
+      while (!controller.signal.aborted) {
+        const response = await fetch(`${API_URL}/jobs/${jobId}?version=${version}&wait=25`, { signal: controller.signal });
+        if (!response.ok) throw new Error(`HTTP error! status: ${response.status}`);
+        const job = await response.json();
+        version = job.version;
+        if (job.status === "succeeded" || job.status === "failed") {
+          if (job.status === "failed") console.error("Falha ao salvar o progresso:", job.error);
+          else if (job.error) console.warn("Progresso salvo parcialmente:", job.error);
+          else console.log(`Análise em background concluída em ${job.duration_s}s.`);
+          break;
         }
-      } catch (err) {
-        console.error("Erro no polling de status:", err);
-        if (pollingInterval.current) clearInterval(pollingInterval.current);
+        if (job.total) console.log(`Salvando progresso: ${job.done}/${job.total} perguntas...`);
+      }
+    } catch (err) {
+      if (!controller.signal.aborted) console.error("Erro ao acompanhar a tarefa:", err);
+    } finally {
+      if (statusWatcher.current === controller) {
+        statusWatcher.current = null;
         setShowLoadingPopup(false);
       }
-    }, 5000);
+    }
   };
 
   const handleAnalysis = async () => {
@@ -226,18 +284,38 @@ export function ChatbotInterface() {
     const analysisMessage: Message = { id: 'analysis-loading', type: "ai", content: t.analysisLoading, timestamp: new Date() };
     setMessages((prev) => [...prev, analysisMessage]);
     try {
-      const response = await fetch(`${API_URL}/exame/analyze`, { method: 'POST' });
-      const data = await response.json();
-      const finalAnalysis: Message = { id: 'analysis-result', type: "ai", content: data.analysis, timestamp: new Date() };
+      const response = await fetch(`${API_URL}/exame/analyze/stream`, { method: 'POST' });
+      let analysisText = "";
+      let jobId: string | null = null;
+      await readEventStream(response, (event, data) => {
+        if (event === "token") {
+          analysisText += data.text;
+        } else if (event === "done") {
+          analysisText = data.analysis;
+          jobId = data.job_id;
+        } else if (event === "error") {
+          throw new Error(data.error);
+        } else {
+          return;
+        }
+        // O texto aparece à medida que é gerado; o popup fica apenas para o salvamento do progresso
+        setShowLoadingPopup(false);
+        const partialAnalysis: Message = { id: 'analysis-result', type: "ai", content: analysisText, timestamp: new Date() };
+        setMessages((prev) => [...prev.filter(m => m.id !== 'analysis-loading' && m.id !== 'analysis-result'), partialAnalysis]);
+      });
+      const finalAnalysis: Message = { id: 'analysis-result', type: "ai", content: analysisText, timestamp: new Date() };
       const guidanceMessage: Message = {
           id: 'rag-guidance', type: 'ai',
           content: 'Análise concluída. A partir de agora, você pode me fazer perguntas sobre a fé e a Doutrina com base nos documentos.',
           categoria: 'Modo de Consulta Ativado', timestamp: new Date()
       };
-      setMessages((prev) => [...prev.filter(m => m.id !== 'analysis-loading'), finalAnalysis, guidanceMessage]);
+      setMessages((prev) => [...prev.filter(m => m.id !== 'analysis-loading' && m.id !== 'analysis-result'), finalAnalysis, guidanceMessage]);
       setIsExamCompleted(true);
       setChatMode('rag');
-      startStatusPolling();
+      if (jobId) {
+        setShowLoadingPopup(true);
+        waitForJob(jobId);
+      }
     } catch (error) {
       console.error("Falha ao obter análise:", error);
       setShowLoadingPopup(false);